@@ -6,11 +6,13 @@ Analyze US Corn Dataset - Comprehensive Description
 # /// script
 # dependencies = [
 #   "pandas>=2.0.0",
+#   "pyarrow>=14.0.0",
 # ]
 # ///
 
 import pandas as pd
 import numpy as np
+import pyarrow.csv as pv
 
 def analyze_dataset():
     file_path = '/Users/francy/agri-feeders/data/dataset_us_corn_2000_2024.csv'
@@ -19,8 +21,9 @@ def analyze_dataset():
     print("US CORN DATASET ANALYSIS")
     print("=" * 80)
 
-    # Read dataset
-    df = pd.read_csv(file_path)
+    # Read dataset (Arrow CSV reader, Arrow-backed dtypes)
+    table = pv.read_csv(file_path)
+    df = table.to_pandas(types_mapper=pd.ArrowDtype)
 
     # Basic info
     print(f"\n1. DATASET OVERVIEW")
@@ -33,31 +36,33 @@ def analyze_dataset():
     # Column information
     print(f"\n2. COLUMN INFORMATION")
     print(f"{'='*40}")
+    # Compute counts and numeric stats once for all columns
+    non_null_counts = df.count()
+    stats = df.select_dtypes(include='number').describe(percentiles=[0.5]).T[['min', 'max', 'mean', '50%']]
     for col in df.columns:
         dtype = df[col].dtype
-        non_null = df[col].count()
+        non_null = non_null_counts[col]
         print(f"\n{col}:")
         print(f"  - Type: {dtype}")
         print(f"  - Non-null count: {non_null:,} / {len(df):,}")
-        if dtype in ['int64', 'float64']:
-            print(f"  - Min: {df[col].min():.2f}")
-            print(f"  - Max: {df[col].max():.2f}")
-            print(f"  - Mean: {df[col].mean():.2f}")
-            print(f"  - Median: {df[col].median():.2f}")
+        if col in stats.index:
+            row = stats.loc[col]
+            print(f"  - Min: {row['min']:.2f}")
+            print(f"  - Max: {row['max']:.2f}")
+            print(f"  - Mean: {row['mean']:.2f}")
+            print(f"  - Median: {row['50%']:.2f}")
 
     # Year coverage
     print(f"\n3. YEAR COVERAGE")
     print(f"{'='*40}")
     year_counts = df['year'].value_counts().sort_index()
-    for year, count in year_counts.items():
-        print(f"{year}: {count:,} records")
+    print("\n".join(f"{year}: {count:,} records" for year, count in year_counts.items()))
 
     # State coverage
     print(f"\n4. STATE COVERAGE")
     print(f"{'='*40}")
     state_counts = df['state_alpha'].value_counts().sort_values(ascending=False)
-    for state, count in state_counts.items():
-        print(f"{state}: {count:,} records")
+    print("\n".join(f"{state}: {count:,} records" for state, count in state_counts.items()))
 
     # County coverage
     print(f"\n5. COUNTY COVERAGE")
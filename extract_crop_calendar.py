@@ -5,35 +5,65 @@ Extract historical crop calendar for US Corn and US Soybean
 
 # /// script
 # dependencies = [
-#   "pandas>=2.0.0",
-#   "openpyxl>=3.1.0",
+#   "pandas>=2.2.0",
+#   "python-calamine>=0.2.0",
 # ]
 # ///
 
 import pandas as pd
 import json
 import sys
-from datetime import datetime
-
-def convert_to_serializable(obj):
-    """Convert pandas objects to JSON serializable format"""
-    if isinstance(obj, dict):
-        return {key: convert_to_serializable(value) for key, value in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_to_serializable(item) for item in obj]
-    elif pd.isna(obj):
-        return None
-    elif isinstance(obj, (pd.Timestamp, datetime)):
-        return obj.strftime('%Y-%m-%d')
-    elif isinstance(obj, (int, float, str, bool)):
-        return obj
-    else:
-        return str(obj)
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+# Sheets are parsed concurrently with the Rust-based calamine reader
+SHEET_READ_WORKERS = 4
+
+def to_serializable(value):
+    """Convert a single cell to a JSON serializable value"""
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    if isinstance(value, (date, datetime)):
+        return value.strftime('%Y-%m-%d')
+    # Anything else (timedelta, time, ...) is written as text
+    return str(value)
+
+def dataframe_to_records(df):
+    """Convert a DataFrame to JSON serializable records, one column at a time"""
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            values = series.dt.strftime('%Y-%m-%d').astype(object)
+        else:
+            values = series.astype(object)
+        values = values.where(series.notna(), None).tolist()
+
+        # Numeric, bool and string columns are already JSON native; object and
+        # other typed columns (e.g. timedelta) can hold dates, times, durations
+        native = (
+            pd.api.types.is_numeric_dtype(series)
+            or (pd.api.types.is_string_dtype(series) and series.dtype != object)
+            or pd.api.types.is_datetime64_any_dtype(series)
+        )
+        if not native:
+            values = [to_serializable(v) for v in values]
+        columns.append(values)
+
+    return [dict(zip(df.columns, row)) for row in zip(*columns)]
 
 def extract_crop_calendar(file_path):
     """Extract crop calendar data for Corn and Soybean"""
 
-    xl_file = pd.ExcelFile(file_path)
+    with pd.ExcelFile(file_path, engine='calamine') as xl_file:
+        sheet_names = xl_file.sheet_names
+
+    def read_sheet(sheet_name):
+        return sheet_name, pd.read_excel(file_path, sheet_name=sheet_name, engine='calamine')
+
+    with ThreadPoolExecutor(max_workers=SHEET_READ_WORKERS) as executor:
+        sheets = list(executor.map(read_sheet, sheet_names))
+
     crop_calendar = {
         "metadata": {
             "source": "USA_50pctPlantedDate_CornSoy.xlsx",
@@ -45,8 +75,7 @@ def extract_crop_calendar(file_path):
         "soybean": {}
     }
 
-    for sheet_name in xl_file.sheet_names:
-        df = pd.read_excel(file_path, sheet_name=sheet_name)
+    for sheet_name, df in sheets:
         print(f"\nProcessing sheet: {sheet_name}")
 
         # Check if sheet contains corn or soybean data
@@ -54,11 +83,11 @@ def extract_crop_calendar(file_path):
         if 'corn' in sheet_lower:
             print(f"Found Corn data in sheet: {sheet_name}")
             print(f"Shape: {df.shape}")
-            crop_calendar["corn"][sheet_name] = convert_to_serializable(df.to_dict('records'))
+            crop_calendar["corn"][sheet_name] = dataframe_to_records(df)
         elif 'soy' in sheet_lower:
             print(f"Found Soybean data in sheet: {sheet_name}")
             print(f"Shape: {df.shape}")
-            crop_calendar["soybean"][sheet_name] = convert_to_serializable(df.to_dict('records'))
+            crop_calendar["soybean"][sheet_name] = dataframe_to_records(df)
 
     return crop_calendar
 
@@ -5,34 +5,38 @@ Filter coffee dataset to remove rows with zero yield_kg_ha
 
 # /// script
 # dependencies = [
-#   "pandas>=2.0.0",
+#   "pyarrow>=14.0.0",
 # ]
 # ///
 
-import pandas as pd
+import pyarrow.compute as pc
+import pyarrow.csv as pv
 import sys
 
+def filter_zero_yield(table):
+    """Drop rows where yield_kg_ha is zero; rows with a missing yield are kept"""
+    return table.filter(pc.fill_null(pc.not_equal(table['yield_kg_ha'], 0.0), True))
+
 def main():
     input_file = '/Users/francy/agri-feeders/data/dataset_cafe_2000_2024.csv'
     output_file = '/Users/francy/agri-feeders/data/dataset_cafe_2000_2024_filtered.csv'
 
     print(f"Reading dataset from {input_file}...")
-    df = pd.read_csv(input_file)
+    table = pv.read_csv(input_file)
 
-    print(f"Total rows before filtering: {len(df)}")
+    print(f"Total rows before filtering: {table.num_rows}")
 
-    # Filter out rows where yield_kg_ha is zero
-    filtered_df = df[df['yield_kg_ha'] != 0.0]
+    filtered = filter_zero_yield(table)
 
-    print(f"Rows with yield_kg_ha=0 removed: {len(df) - len(filtered_df)}")
-    print(f"Total rows after filtering: {len(filtered_df)}")
+    print(f"Rows with yield_kg_ha=0 removed: {table.num_rows - filtered.num_rows}")
+    print(f"Total rows after filtering: {filtered.num_rows}")
 
     # Save filtered dataset
-    filtered_df.to_csv(output_file, index=False)
+    pv.write_csv(filtered, output_file)
     print(f"Filtered dataset saved to {output_file}")
 
-    # Also update the original file
-    df[df['yield_kg_ha'] != 0.0].to_csv(input_file, index=False)
+    # Also update the original file (same filtered table, no second pass)
+    pv.write_csv(filtered, input_file)
     print(f"Original file updated: {input_file}")
 
 if __name__ == '__main__':
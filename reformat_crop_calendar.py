@@ -5,91 +5,87 @@ Reformat crop calendar to match required JSON structure
 
 # /// script
 # dependencies = [
+#   "orjson>=3.9.0",
 #   "pandas>=2.0.0",
 # ]
 # ///
 
-import json
-from datetime import datetime
+import orjson
+import pandas as pd
+
+STATE_ABBREVIATIONS = {
+    'ARKANSAS': 'AR',
+    'ILLINOIS': 'IL',
+    'INDIANA': 'IN',
+    'IOWA': 'IA',
+    'KANSAS': 'KS',
+    'KENTUCKY': 'KY',
+    'LOUISIANA': 'LA',
+    'MICHIGAN': 'MI',
+    'MINNESOTA': 'MN',
+    'MISSISSIPPI': 'MS',
+    'MISSOURI': 'MO',
+    'NEBRASKA': 'NE',
+    'NORTH DAKOTA': 'ND',
+    'OHIO': 'OH',
+    'SOUTH DAKOTA': 'SD',
+    'TENNESSEE': 'TN',
+    'WISCONSIN': 'WI',
+    'US TOTAL': 'US'
+}
 
 def get_state_abbreviation(state_name):
     """Convert full state name to 2-letter abbreviation"""
-    state_map = {
-        'ARKANSAS': 'AR',
-        'ILLINOIS': 'IL',
-        'INDIANA': 'IN',
-        'IOWA': 'IA',
-        'KANSAS': 'KS',
-        'KENTUCKY': 'KY',
-        'LOUISIANA': 'LA',
-        'MICHIGAN': 'MI',
-        'MINNESOTA': 'MN',
-        'MISSISSIPPI': 'MS',
-        'MISSOURI': 'MO',
-        'NEBRASKA': 'NE',
-        'NORTH DAKOTA': 'ND',
-        'OHIO': 'OH',
-        'SOUTH DAKOTA': 'SD',
-        'TENNESSEE': 'TN',
-        'WISCONSIN': 'WI',
-        'US TOTAL': 'US'
-    }
-    return state_map.get(state_name.upper(), state_name)
-
-def convert_date_format(date_str):
-    """Convert YYYY-MM-DD to MM-DD format"""
-    if not date_str or date_str == 'null':
-        return None
-    try:
-        # Parse YYYY-MM-DD format
-        dt = datetime.strptime(date_str, '%Y-%m-%d')
-        # Return MM-DD format
-        return dt.strftime('%m-%d')
-    except:
-        return None
-
-def reformat_crop_calendar():
-    """Reformat the crop calendar to match required structure"""
-
-    # Read the existing JSON
-    with open('/Users/francy/agri-feeders/crop_calendar_us_corn_soybean.json', 'r') as f:
-        data = json.load(f)
-
-    # Create reformatted structure
-    corn_calendar = {"by_planted_year": {}}
-    soybean_calendar = {"by_planted_year": {}}
-
-    # Process Corn data
-    corn_data = data['corn']['CORN']
-    for row in corn_data:
+    return STATE_ABBREVIATIONS.get(state_name.upper(), state_name)
+
+def convert_date_formats(date_strs):
+    """Convert a sequence of YYYY-MM-DD strings to MM-DD (None where invalid)"""
+    dates = pd.to_datetime(pd.Series(date_strs, dtype=object), format='%Y-%m-%d', errors='coerce')
+    mm_dd = dates.dt.strftime('%m-%d')
+    return mm_dd.astype(object).where(dates.notna(), None).tolist()
+
+def build_calendar(rows):
+    """Build {"by_planted_year": {year: {state: MM-DD}}} from sheet rows"""
+    calendar = {"by_planted_year": {}}
+
+    # Flatten all cells first so the date parsing runs once over the whole sheet
+    # State headers repeat on every row; resolve each distinct header only once
+    header_codes = {}
+    years = []
+    state_codes = []
+    date_strs = []
+    for row in rows:
         year = str(row['Row Labels'])
-        corn_calendar["by_planted_year"][year] = {}
+        calendar["by_planted_year"][year] = {}
 
         for state_name, date_str in row.items():
             if state_name == 'Row Labels':
                 continue
+            state_code = header_codes.get(state_name)
+            if state_code is None:
+                state_code = header_codes[state_name] = get_state_abbreviation(state_name)
+            years.append(year)
+            state_codes.append(state_code)
+            date_strs.append(date_str)
 
-            state_code = get_state_abbreviation(state_name)
-            mm_dd = convert_date_format(date_str)
+    for year, state_code, mm_dd in zip(years, state_codes, convert_date_formats(date_strs)):
+        if mm_dd:
+            calendar["by_planted_year"][year][state_code] = mm_dd
 
-            if mm_dd:
-                corn_calendar["by_planted_year"][year][state_code] = mm_dd
+    return calendar
 
-    # Process Soybean data
-    soy_data = data['soybean']['SOY']
-    for row in soy_data:
-        year = str(row['Row Labels'])
-        soybean_calendar["by_planted_year"][year] = {}
+def reformat_crop_calendar():
+    """Reformat the crop calendar to match required structure"""
 
-        for state_name, date_str in row.items():
-            if state_name == 'Row Labels':
-                continue
+    # Read the existing JSON
+    with open('/Users/francy/agri-feeders/crop_calendar_us_corn_soybean.json', 'rb') as f:
+        data = orjson.loads(f.read())
 
-            state_code = get_state_abbreviation(state_name)
-            mm_dd = convert_date_format(date_str)
+    # Process Corn data
+    corn_calendar = build_calendar(data['corn']['CORN'])
 
-            if mm_dd:
-                soybean_calendar["by_planted_year"][year][state_code] = mm_dd
+    # Process Soybean data
+    soybean_calendar = build_calendar(data['soybean']['SOY'])
 
     return corn_calendar, soybean_calendar
 
@@ -101,33 +97,37 @@ def main():
     # Reformat the data
     corn_calendar, soybean_calendar = reformat_crop_calendar()
 
+    # Serialize each calendar once (compact); the combined file reuses the same bytes
+    corn_json = orjson.dumps(corn_calendar)
+    soybean_json = orjson.dumps(soybean_calendar)
+
     # Save corn calendar
     corn_file = '/Users/francy/agri-feeders/crop_calendar_us_corn.json'
-    with open(corn_file, 'w') as f:
-        json.dump(corn_calendar, f, indent=2)
+    with open(corn_file, 'wb') as f:
+        f.write(corn_json)
     print(f"\nCorn calendar saved: {corn_file}")
 
     # Save soybean calendar
     soybean_file = '/Users/francy/agri-feeders/crop_calendar_us_soybean.json'
-    with open(soybean_file, 'w') as f:
-        json.dump(soybean_calendar, f, indent=2)
+    with open(soybean_file, 'wb') as f:
+        f.write(soybean_json)
     print(f"Soybean calendar saved: {soybean_file}")
 
-    # Create combined file
-    combined = {
-        "corn": corn_calendar,
-        "soybean": soybean_calendar
-    }
+    # Create combined file: {"corn": ..., "soybean": ...}
     combined_file = '/Users/francy/agri-feeders/crop_calendar_us_corn_soybean_formatted.json'
-    with open(combined_file, 'w') as f:
-        json.dump(combined, f, indent=2)
+    with open(combined_file, 'wb') as f:
+        f.write(b'{"corn":')
+        f.write(corn_json)
+        f.write(b',"soybean":')
+        f.write(soybean_json)
+        f.write(b'}')
     print(f"Combined calendar saved: {combined_file}")
 
     # Print sample
     print("\n" + "="*80)
     print("SAMPLE OUTPUT - Corn Calendar")
     print("="*80)
-    print(json.dumps(corn_calendar, indent=2)[:500] + "...")
+    print(orjson.dumps(corn_calendar, option=orjson.OPT_INDENT_2).decode()[:500] + "...")
 
     print("\n" + "="*80)
     print("SUMMARY")
@@ -2,30 +2,36 @@
 # /// script
 # requires-python = ">=3.10"
 # dependencies = [
-#     "httpx",
+#     "httpx[http2]",
 #     "click",
+#     "orjson",
 #     "pandas",
 #     "pyarrow",
+#     "zstandard",
 # ]
 # ///
 
 """
 IBGE SIDRA Bulk Extractor - Municipality Level
-Generates CSV, Parquet, and JSON datasets for specific crops and states.
+Generates Parquet (default), CSV, and JSON datasets for specific crops and states.
 Includes Geolocation (Lat/Lon).
 
 Usage:
     uv run STEP1_AYP_SFHTML_ibge_extract_history.py --crop soja --start 2020 --end 2023
-    uv run STEP1_AYP_SFHTML_ibge_extract_history.py --crop milho --start 2022 --end 2022
+    uv run STEP1_AYP_SFHTML_ibge_extract_history.py --crop milho --start 2022 --end 2022 --formats csv,parquet,json
 """
 
+import asyncio
+import hashlib
 import httpx
 import click
+import orjson
 import pandas as pd
+import pyarrow as pa
 import sys
-import time
 import io
 import os
+import zstandard as zstd
 from pathlib import Path
 from datetime import datetime
 
@@ -33,8 +39,28 @@ from datetime import datetime
 
 # Cache configuration
 CACHE_DIR = Path.home() / '.ibge_cache'
-CACHE_FILE = CACHE_DIR / 'municipios_geo.parquet'
+CACHE_FILE = CACHE_DIR / 'municipios_geo.arrow'  # Arrow IPC: memory-mapped, no decode step
 CACHE_MAX_AGE_DAYS = 90  # Municipality coordinates rarely change
+SIDRA_CACHE_DIR = CACHE_DIR / 'sidra'
+SIDRA_CACHE_MAX_AGE_DAYS = 30
+
+# Concurrent SIDRA requests (kept low to stay polite with the IBGE API)
+MAX_CONCURRENT_REQUESTS = 6
+FETCH_RETRIES = 3
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+OUTPUT_FORMATS = ('csv', 'parquet', 'json')
+
+# Compact dtypes for the Parquet output. float32 keeps ~7 significant digits,
+# enough for IBGE's published precision; CSV/JSON keep float64 text.
+# 'year' stays a string, as in the CSV/JSON outputs and the published datasets.
+PARQUET_DTYPES = {
+    'latitude': 'float32',
+    'longitude': 'float32',
+    'yield_kg_ha': 'float32',
+    'production_1000t': 'float32',
+    'area_planted_1000ha': 'float32',
+}
 
 # Map State Abbreviations to IBGE IDs
 STATE_MAP = {
@@ -90,10 +116,19 @@ def load_cached_geo_data():
 
     print(f"📁 Loading geo data from cache: {CACHE_FILE}")
     try:
-        return pd.read_parquet(CACHE_FILE)
+        with pa.memory_map(str(CACHE_FILE)) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
     except Exception:
         return None
 
+def save_geo_data_to_cache(df):
+    """Save municipality geo data as an Arrow IPC file."""
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with pa.OSFile(str(CACHE_FILE), 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
 def fetch_geo_data():
     """
     Downloads Brazilian Municipality Lat/Lon reference.
@@ -114,23 +149,52 @@ def fetch_geo_data():
         
         # Parse CSV
         # Columns: codigo_ibge, nome, latitude, longitude, capital, codigo_uf
-        df = pd.read_csv(io.BytesIO(response.content))
-        
-        # Select relevant columns
-        df = df[['codigo_ibge', 'latitude', 'longitude']].copy()
-        
-        # Ensure ID is string (SIDRA uses strings)
-        df['codigo_ibge'] = df['codigo_ibge'].astype(str)
+        # ID parsed straight to an Arrow-backed string (SIDRA uses strings);
+        # the dtype round-trips through the Arrow cache file
+        df = pd.read_csv(
+            io.BytesIO(response.content),
+            usecols=['codigo_ibge', 'latitude', 'longitude'],
+            dtype={'codigo_ibge': 'string[pyarrow]'}
+        )
         
         # Save to cache
-        CACHE_DIR.mkdir(parents=True, exist_ok=True)
-        df.to_parquet(CACHE_FILE, index=False)
+        save_geo_data_to_cache(df)
         
         return df
     except Exception as e:
         print(f"    ⚠️ Warning: Could not fetch geo data ({e}). Output will lack coordinates.")
         return pd.DataFrame()
 
+# --- SIDRA Response Cache ---
+
+def sidra_cache_path(url):
+    """Cache file for a fully composed SIDRA URL."""
+    cache_key = hashlib.sha1(url.encode()).hexdigest()
+    return SIDRA_CACHE_DIR / f"{cache_key}.json.zst"
+
+def load_cached_response(url):
+    """Load a cached SIDRA response, or None if missing/stale/corrupt."""
+    path = sidra_cache_path(url)
+    if not path.exists():
+        return None
+
+    cache_age_days = (datetime.now().timestamp() - path.stat().st_mtime) / (24 * 3600)
+    if cache_age_days > SIDRA_CACHE_MAX_AGE_DAYS:
+        return None
+
+    try:
+        return orjson.loads(zstd.ZstdDecompressor().decompress(path.read_bytes()))
+    except Exception:
+        return None
+
+def save_response_to_cache(url, content):
+    """Store the raw SIDRA response body, zstd-compressed."""
+    try:
+        SIDRA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        sidra_cache_path(url).write_bytes(zstd.ZstdCompressor().compress(content))
+    except Exception as e:
+        print(f"    ⚠️ Cache write error: {e}")
+
 # --- IBGE API Logic ---
 
 def get_query_params(crop_name):
@@ -143,7 +207,7 @@ def get_query_params(crop_name):
     else:
         raise ValueError(f"Crop '{crop_name}' not supported. Available: {list(PRODUTOS.keys())}")
 
-def fetch_state_data(table_id, period, var_codes_str, class_id, prod_code, state_code):
+async def fetch_state_data(client, semaphore, table_id, period, var_codes_str, class_id, prod_code, state_code, use_cache=True):
     """
     Fetches data for ALL municipalities in a specific state.
     URL Syntax: localities=N6[N3[state_code]] -> All Munis (N6) inside State (N3)
@@ -157,13 +221,49 @@ def fetch_state_data(table_id, period, var_codes_str, class_id, prod_code, state
         f"&classificacao={class_id}[{prod_code}]"
     )
 
-    try:
-        response = httpx.get(url, timeout=60.0)
-        response.raise_for_status()
-        return response.json()
-    except httpx.HTTPError as e:
-        print(f"    Error fetching state {state_code}: {e}")
-        return None
+    if use_cache:
+        cached = load_cached_response(url)
+        if cached is not None:
+            return cached
+
+    async with semaphore:
+        for attempt in range(FETCH_RETRIES):
+            last_attempt = attempt == FETCH_RETRIES - 1
+            try:
+                response = await client.get(url)
+                if response.status_code in RETRY_STATUS_CODES and not last_attempt:
+                    await asyncio.sleep(min(30, 0.5 * 2 ** attempt))
+                    continue
+                response.raise_for_status()
+                data = orjson.loads(response.content)
+                if use_cache:
+                    save_response_to_cache(url, response.content)
+                return data
+            except httpx.TransportError as e:
+                if last_attempt:
+                    print(f"    Error fetching state {state_code}: {e}")
+                    return None
+                await asyncio.sleep(min(30, 0.5 * 2 ** attempt))
+            except httpx.HTTPStatusError as e:
+                print(f"    Error fetching state {state_code}: {e}")
+                return None
+
+async def fetch_all_states(states, period, table_id, var_codes_str, class_id, prod_code, use_cache=True):
+    """
+    Downloads the full period for every state concurrently.
+    Returns a dict keyed by state_abbr so callers can process in a fixed order.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    limits = httpx.Limits(max_keepalive_connections=16)
+    async with httpx.AsyncClient(http2=True, timeout=60.0, limits=limits) as client:
+        results = await asyncio.gather(*(
+            fetch_state_data(
+                client, semaphore, table_id, period, var_codes_str, class_id, prod_code, STATE_MAP[state_abbr],
+                use_cache=use_cache
+            )
+            for state_abbr in states
+        ))
+    return dict(zip(states, results))
 
 def parse_sidra_json_to_df(json_data, state_abbr, var_map):
     """
@@ -172,9 +272,16 @@ def parse_sidra_json_to_df(json_data, state_abbr, var_map):
     if not json_data:
         return pd.DataFrame()
 
-    records = []
     code_to_name = {v: k for k, v in var_map.items()}
 
+    # Accumulate directly in wide format: one row per (municipality, year),
+    # one column per variable. Avoids building a long frame and pivoting it.
+    key_to_row = {}
+    muni_codes = []
+    region_names = []
+    years = []
+    values = {name: [] for name in var_map}
+
     for var_block in json_data:
         variable_id = var_block.get('id')
         if variable_id not in code_to_name:
@@ -187,6 +294,7 @@ def parse_sidra_json_to_df(json_data, state_abbr, var_map):
             continue
 
         series_list = results[0].get('series', [])
+        column = values[var_name]
         
         for item in series_list:
             muni_code = item['localidade']['id']
@@ -194,45 +302,55 @@ def parse_sidra_json_to_df(json_data, state_abbr, var_map):
             serie_data = item.get('serie', {})
             
             for year, value in serie_data.items():
-                if value in ['...', '-', 'X', '..'] or value is None:
-                    val_float = 0.0
-                else:
-                    try:
-                        val_float = float(value)
-                    except:
-                        val_float = 0.0
-
-                records.append({
-                    'municipio_cod': muni_code,
-                    'region_name': muni_name,
-                    'state_name': state_abbr,
-                    'year': year,
-                    'variable': var_name,
-                    'value': val_float
-                })
-
-    if not records:
+                key = (muni_code, year)
+                row = key_to_row.get(key)
+                if row is None:
+                    row = len(muni_codes)
+                    key_to_row[key] = row
+                    muni_codes.append(muni_code)
+                    region_names.append(muni_name)
+                    years.append(year)
+                    for col in values.values():
+                        col.append(None)
+
+                # Raw SIDRA string; parsed in bulk below
+                column[row] = value
+
+    if not key_to_row:
         return pd.DataFrame()
 
-    df_long = pd.DataFrame(records)
-    
-    # Pivot to Wide Format
-    df_wide = df_long.pivot_table(
-        index=['year', 'municipio_cod', 'region_name', 'state_name'],
-        columns='variable',
-        values='value',
-        fill_value=0
-    ).reset_index()
+    # Vectorized parse: SIDRA placeholders ('...', '-', 'X', '..') and None become 0
+    for var_name, column in values.items():
+        values[var_name] = pd.to_numeric(pd.Series(column, dtype=object), errors='coerce').fillna(0.0)
+
+    df_wide = pd.DataFrame({
+        'year': years,
+        'municipio_cod': pd.array(muni_codes, dtype='string[pyarrow]'),
+        'region_name': region_names,
+        'state_name': state_abbr,
+        **values
+    })
 
     return df_wide
 
+def parse_formats(ctx, param, value):
+    """Click callback: validates a comma separated list of output formats."""
+    formats = [f.strip().lower() for f in value.split(',') if f.strip()]
+    unknown = [f for f in formats if f not in OUTPUT_FORMATS]
+    if unknown or not formats:
+        raise click.BadParameter(f"Choose from: {', '.join(OUTPUT_FORMATS)} (got '{value}')")
+    return formats
+
 @click.command()
 @click.option('--crop', '-c', required=True, help='Crop name (e.g., soja, milho)')
 @click.option('--start', '-s', required=True, type=int, help='Start year')
 @click.option('--end', '-e', required=True, type=int, help='End year')
-def main(crop, start, end):
+@click.option('--no-cache', is_flag=True, help='Ignore cached SIDRA responses and re-download')
+@click.option('--formats', '-f', default='parquet', callback=parse_formats,
+              help='Comma separated output formats: csv,parquet,json (default: parquet)')
+def main(crop, start, end, no_cache, formats):
     """
-    Extracts IBGE agricultural data for specified states and generates CSV/Parquet/JSON.
+    Extracts IBGE agricultural data for specified states and generates Parquet/CSV/JSON.
     """
     try:
         table_id, class_id, prod_code, var_map = get_query_params(crop)
@@ -250,32 +368,28 @@ def main(crop, start, end):
     print(f"📍 Target States: {', '.join(TARGET_STATES)}")
     print("-" * 60)
 
-    # Loop Logic: Year -> State
-    for year in range(start, end + 1):
-        print(f"📅 Processing Year: {year}")
-        
-        for state_abbr in TARGET_STATES:
-            state_code = STATE_MAP.get(state_abbr)
-            if not state_code:
-                continue
+    # One request per state covering all years (SIDRA accepts period ranges)
+    period = str(start) if start == end else f"{start}-{end}"
+    states = [s for s in TARGET_STATES if s in STATE_MAP]
+    print(f"⏬ Downloading {len(states)} states ({MAX_CONCURRENT_REQUESTS} concurrent)...")
+    responses = asyncio.run(
+        fetch_all_states(states, period, table_id, var_codes_str, class_id, prod_code, use_cache=not no_cache)
+    )
 
-            print(f"  Downloading {state_abbr}...", end=" ", flush=True)
-            
-            raw_json = fetch_state_data(
-                table_id, str(year), var_codes_str, class_id, prod_code, state_code
-            )
+    for state_abbr in states:
+        print(f"  {state_abbr}...", end=" ")
 
-            if raw_json:
-                df_state = parse_sidra_json_to_df(raw_json, state_abbr, var_map)
-                if not df_state.empty:
-                    all_data.append(df_state)
-                    print(f"✅ ({len(df_state)} munis)")
-                else:
-                    print("⚠️ No data")
+        raw_json = responses[state_abbr]
+
+        if raw_json:
+            df_state = parse_sidra_json_to_df(raw_json, state_abbr, var_map)
+            if not df_state.empty:
+                all_data.append(df_state)
+                print(f"✅ ({len(df_state)} muni-years)")
             else:
-                print("❌ API Error")
-            
-            time.sleep(0.5)
+                print("⚠️ No data")
+        else:
+            print("❌ API Error")
 
     print("-" * 60)
     
@@ -284,66 +398,65 @@ def main(crop, start, end):
         sys.exit(1)
 
     # Combine all chunks
-    final_df = pd.concat(all_data, ignore_index=True)
+    combined = pd.concat(all_data, ignore_index=True)
 
     # --- Post Processing ---
     
     required_vars = ['production', 'yield', 'area_planted']
     for v in required_vars:
-        if v not in final_df.columns:
-            final_df[v] = 0.0
+        if v not in combined.columns:
+            combined[v] = 0.0
 
-    # Conversions
-    final_df.rename(columns={'yield': 'yield_kg_ha'}, inplace=True)
-    final_df['production_1000t'] = final_df['production'] / 1000.0
-    final_df['area_planted_1000ha'] = final_df['area_planted'] / 1000.0
-
-    # --- Merge with Geo Data ---
+    # --- Geo Data (Lat/Lon) ---
     if not geo_df.empty:
-        # Ensure matching types (IBGE uses 7 digits generally)
-        final_df['municipio_cod'] = final_df['municipio_cod'].astype(str)
-        # Left Join
-        final_df = final_df.merge(geo_df, left_on='municipio_cod', right_on='codigo_ibge', how='left')
+        # Left Join via hash lookup (no join index / result frame allocation)
+        lat_map = dict(zip(geo_df['codigo_ibge'], geo_df['latitude']))
+        lon_map = dict(zip(geo_df['codigo_ibge'], geo_df['longitude']))
+        latitude = combined['municipio_cod'].map(lat_map)
+        longitude = combined['municipio_cod'].map(lon_map)
     else:
-        final_df['latitude'] = None
-        final_df['longitude'] = None
-
-    # Final selection
-    cols_order = [
-        'year', 
-        'region_name', 
-        'state_name',
-        'municipio_cod', # Kept for reference
-        'latitude',      # Added
-        'longitude',     # Added
-        'yield_kg_ha', 
-        'production_1000t', 
-        'area_planted_1000ha'
-    ]
-    
-    # Filter columns that exist (in case geo failed)
-    cols_order = [c for c in cols_order if c in final_df.columns]
-    
-    final_df = final_df[cols_order]
+        latitude = None
+        longitude = None
+
+    # Build the output frame in final column order in one step
+    # (no rename / column inserts / re-selection copies)
+    final_df = pd.DataFrame({
+        'year': combined['year'],
+        'region_name': combined['region_name'],
+        'state_name': combined['state_name'],
+        'municipio_cod': combined['municipio_cod'],  # Kept for reference
+        'latitude': latitude,
+        'longitude': longitude,
+        'yield_kg_ha': combined['yield'],
+        'production_1000t': combined['production'] / 1000.0,
+        'area_planted_1000ha': combined['area_planted'] / 1000.0,
+    })
+    del combined
+
     final_df.sort_values(by=['year', 'state_name', 'region_name'], inplace=True)
 
     # --- Output ---
     output_base = f"dataset_{crop}_{start}_{end}"
     
-    # 1. CSV
-    csv_path = f"{output_base}.csv"
-    final_df.to_csv(csv_path, index=False)
-    print(f"💾 Saved CSV: {csv_path}")
-
-    # 2. Parquet
-    pq_path = f"{output_base}.parquet"
-    final_df.to_parquet(pq_path, index=False)
-    print(f"💾 Saved Parquet: {pq_path}")
-
-    # 3. JSON
-    json_path = f"{output_base}.json"
-    final_df.to_json(json_path, orient='records', indent=4, double_precision=15)
-    print(f"💾 Saved JSON: {json_path}")
+    # 1. Parquet
+    if 'parquet' in formats:
+        pq_path = f"{output_base}.parquet"
+        final_df.astype(PARQUET_DTYPES).to_parquet(
+            pq_path, index=False, engine='pyarrow', compression='zstd', compression_level=3
+        )
+        print(f"💾 Saved Parquet: {pq_path}")
+
+    # 2. CSV
+    if 'csv' in formats:
+        csv_path = f"{output_base}.csv"
+        final_df.to_csv(csv_path, index=False)
+        print(f"💾 Saved CSV: {csv_path}")
+
+    # 3. JSON (compact records array, as consumed by STEP2)
+    if 'json' in formats:
+        json_path = f"{output_base}.json"
+        final_df.to_json(json_path, orient='records', double_precision=15)
+        print(f"💾 Saved JSON: {json_path}")
 
     print(f"\nTotal Records: {len(final_df)}")
     if 'latitude' in final_df.columns:
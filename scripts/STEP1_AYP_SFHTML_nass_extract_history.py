@@ -2,8 +2,9 @@
 # /// script
 # requires-python = ">=3.10"
 # dependencies = [
-#     "httpx",
+#     "httpx[http2]",
 #     "click",
+#     "orjson",
 #     "pandas",
 #     "pyarrow",
 # ]
@@ -25,14 +26,19 @@ Usage:
     uv run STEP1_AYP_SFHTML_nass_extract_history.py --crop corn --start 2000 --end 2024
 """
 
+import asyncio
 import httpx
 import click
+import orjson
 import pandas as pd
-import io
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import csv as pacsv
 import sys
-import time
 import os
+import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime
 
@@ -65,6 +71,21 @@ STAT_CATEGORIES = ['AREA PLANTED', 'YIELD', 'PRODUCTION']
 
 NASS_BASE_URL = "https://quickstats.nass.usda.gov/api/api_GET/"
 
+# Record fields used downstream (also what the query cache keeps)
+NASS_RECORD_FIELDS = ['county_ansi', 'county_name', 'year', 'statisticcat_desc', 'Value']
+
+# Concurrent NASS requests and retry policy
+MAX_CONCURRENT_REQUESTS = 8
+FETCH_RETRIES = 3
+
+# Parquet-only dtypes: names/FIPS repeat once per year, so store them dictionary-encoded
+PARQUET_DTYPES = {
+    'state_alpha': 'category',
+    'county_name': 'category',
+    'county_fips': 'category',
+}
+PARQUET_ROW_GROUP_SIZE = 50_000
+
 API_HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36',
     'Accept': 'application/json'
@@ -117,7 +138,7 @@ def save_geo_data_to_cache(df):
         print(f"    ⚠️ Cache write error: {e}")
 
 
-def fetch_geo_data_from_census():
+async def fetch_geo_data_from_census(client):
     """
     Downloads Census Bureau Gazetteer file and builds reference DataFrame.
     Includes: FIPS, Area (Acres), Latitude, Longitude.
@@ -133,15 +154,17 @@ def fetch_geo_data_from_census():
     print(f"    🔗 {url}")
 
     try:
-        with httpx.Client(timeout=60.0) as client:
-            resp = client.get(url)
+        # Stream the ZIP to a spooled temp file (spills to disk past 16 MB)
+        spool = tempfile.SpooledTemporaryFile(max_size=16 << 20)
+        async with client.stream("GET", url, headers={'Accept': '*/*'}) as resp:
             resp.raise_for_status()
+            async for chunk in resp.aiter_bytes(1 << 20):
+                spool.write(chunk)
+        spool.seek(0)
 
         print("    📥 Parsing Gazetteer file...")
 
-        # Unzip in memory
-        zip_buffer = io.BytesIO(resp.content)
-        with zipfile.ZipFile(zip_buffer, 'r') as zf:
+        with spool, zipfile.ZipFile(spool, 'r') as zf:
             txt_files = [f for f in zf.namelist() if f.endswith('.txt')]
             if not txt_files:
                 return pd.DataFrame()
@@ -149,31 +172,35 @@ def fetch_geo_data_from_census():
             with zf.open(txt_files[0]) as f:
                 # Gazetteer is tab-delimited. 
                 # Columns usually: USPS, GEOID, ANSICODE, NAME, ALAND_SQMI, INTPTLAT, INTPTLONG...
-                df = pd.read_csv(f, sep='\t', dtype=str)
-
-        # Clean column names (Census files often have whitespace like "INTPTLONG   ")
-        df.columns = [c.strip() for c in df.columns]
-
-        required_cols = ['GEOID', 'ALAND_SQMI', 'INTPTLAT', 'INTPTLONG']
-        
-        # Check if columns exist
-        missing = [c for c in required_cols if c not in df.columns]
-        if missing:
-            print(f"    ❌ Expected columns missing: {missing}. Found: {list(df.columns)}")
-            return pd.DataFrame()
-
-        # Select and Rename
-        df = df[required_cols].copy()
-        df.rename(columns={
-            'GEOID': 'fips',
-            'INTPTLAT': 'latitude',
-            'INTPTLONG': 'longitude'
-        }, inplace=True)
-
-        # Convert Types
-        df['ALAND_SQMI'] = pd.to_numeric(df['ALAND_SQMI'], errors='coerce')
-        df['latitude'] = pd.to_numeric(df['latitude'], errors='coerce')
-        df['longitude'] = pd.to_numeric(df['longitude'], errors='coerce')
+                # Clean column names (Census files often have whitespace like "INTPTLONG   ")
+                columns = [c.strip() for c in f.readline().decode('utf-8-sig').rstrip('\r\n').split('\t')]
+
+                required_cols = ['GEOID', 'ALAND_SQMI', 'INTPTLAT', 'INTPTLONG']
+
+                # Check if columns exist
+                missing = [c for c in required_cols if c not in columns]
+                if missing:
+                    print(f"    ❌ Expected columns missing: {missing}. Found: {columns}")
+                    return pd.DataFrame()
+
+                # Only parse the 4 columns we use; GEOID stays a string to keep leading zeros
+                table = pacsv.read_csv(
+                    f,
+                    read_options=pacsv.ReadOptions(column_names=columns),
+                    parse_options=pacsv.ParseOptions(delimiter='\t'),
+                    convert_options=pacsv.ConvertOptions(
+                        include_columns=required_cols,
+                        column_types={
+                            'GEOID': pa.string(),
+                            'ALAND_SQMI': pa.float64(),
+                            'INTPTLAT': pa.float64(),
+                            'INTPTLONG': pa.float64(),
+                        }
+                    )
+                )
+
+        # Rename in Arrow before handing over to pandas
+        df = table.rename_columns(['fips', 'ALAND_SQMI', 'latitude', 'longitude']).to_pandas()
 
         # Convert sq miles to acres (1 sq mile = 640 acres)
         df['area_acres'] = df['ALAND_SQMI'] * 640.0
@@ -195,40 +222,147 @@ def fetch_geo_data_from_census():
 
 # --- NASS API Query ---
 
-def fetch_state_crop_data(client, api_key, state_alpha, commodity, year):
+def nass_cache_path(commodity, state_alpha, start, end):
+    return CACHE_DIR / f"nass_{commodity}_{state_alpha}_{start}_{end}.parquet"
+
+
+def load_cached_nass_records(commodity, state_alpha, start, end):
+    """
+    Load NASS records for a state/year-range from the query cache if fresh.
+    Returns a list of records or None.
+    """
+    cache_path = nass_cache_path(commodity, state_alpha, start, end)
+    if not cache_path.exists():
+        return None
+
+    cache_age_days = (datetime.now().timestamp() - cache_path.stat().st_mtime) / (24 * 3600)
+    if cache_age_days > CACHE_MAX_AGE_DAYS:
+        return None
+
+    try:
+        return pd.read_parquet(cache_path).to_dict('records')
+    except Exception:
+        return None
+
+
+def save_nass_records_to_cache(records, commodity, state_alpha, start, end):
     """
-    Query NASS API for county-level crop data for a single state and year.
+    Save the fields we use from NASS records to the query cache.
     """
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df = pd.DataFrame(records, columns=NASS_RECORD_FIELDS)
+        df.to_parquet(nass_cache_path(commodity, state_alpha, start, end), index=False)
+    except Exception as e:
+        print(f"    ⚠️ Could not cache {state_alpha}/{start}-{end}: {e}")
+
+
+async def query_nass(client, semaphore, params):
+    """
+    Run one NASS API query with retries.
+    Returns (status_code, records); records is None unless the query succeeded.
+    """
+    status = None
+    async with semaphore:
+        for attempt in range(FETCH_RETRIES):
+            try:
+                response = await client.get(NASS_BASE_URL, params=params)
+                status = response.status_code
+                if status == 200:
+                    data = response.json()
+                    return status, data.get('data', [])
+                elif status == 429 or status >= 500:
+                    # Only wait on rate limiting / server errors
+                    await asyncio.sleep(1 * (attempt + 1))
+                    continue
+                else:
+                    return status, None
+            except Exception as e:
+                await asyncio.sleep(1)
+                continue
+
+    return status, None
+
+
+async def fetch_state_crop_data(client, semaphore, api_key, state_alpha, commodity, start, end, use_cache=True):
+    """
+    Query NASS API for county-level crop data for a single state over a year range.
+    NASS rejects queries above 50,000 records (HTTP 413); the range is then split in half.
+    Successful results are cached per (commodity, state, year range).
+    """
+    if use_cache:
+        cached = load_cached_nass_records(commodity, state_alpha, start, end)
+        if cached is not None:
+            return cached
+
     params = {
         'key': api_key,
         'commodity_desc': commodity,
         'state_alpha': state_alpha,
         'agg_level_desc': 'COUNTY',
-        'year': str(year),
+        'year__GE': str(start),
+        'year__LE': str(end),
         'format': 'json',
     }
 
-    # Retry logic
-    for attempt in range(3):
-        try:
-            response = client.get(NASS_BASE_URL, params=params, timeout=60.0)
-            if response.status_code == 200:
-                data = response.json()
-                return data.get('data', [])
-            elif response.status_code == 413:
-                print(f"    ⚠️ Too many records for {state_alpha}/{year}")
-                return []
-            elif response.status_code >= 500:
-                time.sleep(1 * (attempt + 1))
-                continue
-            else:
-                print(f"    ❌ HTTP {response.status_code}")
-                return None
-        except Exception as e:
-            time.sleep(1)
-            continue
+    status, records = await query_nass(client, semaphore, params)
+
+    if status == 413:
+        if start == end:
+            print(f"    ⚠️ Too many records for {state_alpha}/{start}")
+            return []
+        mid = (start + end) // 2
+        halves = await asyncio.gather(
+            fetch_state_crop_data(client, semaphore, api_key, state_alpha, commodity, start, mid, use_cache),
+            fetch_state_crop_data(client, semaphore, api_key, state_alpha, commodity, mid + 1, end, use_cache),
+        )
+        if any(half is None for half in halves):
+            return None
+        records = halves[0] + halves[1]
+        save_nass_records_to_cache(records, commodity, state_alpha, start, end)
+        return records
 
-    return None
+    if records is None and status is not None:
+        print(f"    ❌ HTTP {status} for {state_alpha}/{start}-{end}")
+    elif records is not None:
+        save_nass_records_to_cache(records, commodity, state_alpha, start, end)
+
+    return records
+
+
+async def fetch_all_crop_data(client, states, start, end, api_key, commodity, use_cache=True):
+    """
+    Downloads the full year range for every state concurrently.
+    Returns a dict keyed by state_alpha so callers can process in a fixed order.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    results = await asyncio.gather(*(
+        fetch_state_crop_data(client, semaphore, api_key, state_alpha, commodity, start, end, use_cache)
+        for state_alpha in states
+    ))
+    return dict(zip(states, results))
+
+
+async def download_all(crop, start, end, api_key, use_cache=True):
+    """
+    Fetches the Gazetteer and the NASS data over one shared HTTP/2 client,
+    so NASS requests are multiplexed over a single reused connection.
+    Returns (geo_ref_df, responses).
+    """
+    commodity = CROPS[crop]
+    limits = httpx.Limits(max_connections=16)
+    async with httpx.AsyncClient(http2=True, headers=API_HEADERS, timeout=60.0, limits=limits) as client:
+        # 1. Fetch County Geo Reference (Area + Lat/Lon)
+        geo_ref_df = await fetch_geo_data_from_census(client)
+
+        print("-" * 60)
+        print(f"🌽 Starting extraction for {crop.upper()} ({start}-{end})")
+
+        # One request per state covering the whole year range
+        print(f"⏬ Downloading {len(CORN_BELT_STATES)} states ({MAX_CONCURRENT_REQUESTS} concurrent)...")
+        responses = await fetch_all_crop_data(client, CORN_BELT_STATES, start, end, api_key, commodity, use_cache)
+
+    return geo_ref_df, responses
 
 
 def parse_nass_json_to_df(records, state_alpha):
@@ -238,55 +372,94 @@ def parse_nass_json_to_df(records, state_alpha):
     if not records:
         return pd.DataFrame()
 
-    parsed = []
     state_fips = STATE_FIPS.get(state_alpha, '')
 
-    for rec in records:
-        county_ansi = rec.get('county_ansi', '')
-        if not county_ansi or len(county_ansi) != 3:
-            continue
+    # Build the frame once, keeping only the fields we use, then clean column-wise
+    df = pd.DataFrame(records, columns=NASS_RECORD_FIELDS)
 
-        fips = state_fips + county_ansi
-
-        value_str = rec.get('Value', '')
-        if value_str in ['(D)', '(Z)', '(NA)', '(S)', '(H)', '(L)', ''] or value_str is None:
-            val_float = 0.0
-        else:
-            try:
-                val_float = float(value_str.replace(',', ''))
-            except:
-                val_float = 0.0
-
-        parsed.append({
-            'county_fips': fips,
-            'county_name': rec.get('county_name', '').title(),
-            'state_alpha': state_alpha,
-            'year': rec.get('year', ''),
-            'statistic': rec.get('statisticcat_desc', ''),
-            'value': val_float
-        })
-
-    if not parsed:
+    county_ansi = df['county_ansi'].fillna('').astype(str)
+    is_county = county_ansi.str.len() == 3
+    if not is_county.any():
         return pd.DataFrame()
+    df = df[is_county]
 
-    df_long = pd.DataFrame(parsed)
+    # Suppressed/withheld markers like (D), (Z), (NA) fail to parse and become 0
+    value = df['Value'].astype(str).str.strip().str.replace(',', '', regex=False)
 
-    df_wide = df_long.pivot_table(
-        index=['year', 'county_fips', 'county_name', 'state_alpha'],
-        columns='statistic',
-        values='value',
-        aggfunc='first'
-    ).reset_index()
+    df_long = pd.DataFrame({
+        # Integer FIPS keeps the geo merge key narrow; zero-padded again on output
+        'county_fips': (state_fips + county_ansi[is_county]).astype('uint32'),
+        'county_name': df['county_name'].fillna('').astype(str).str.title(),
+        'state_alpha': state_alpha,
+        'year': df['year'].fillna(''),
+        'statistic': df['statisticcat_desc'].fillna(''),
+        'value': pd.to_numeric(value, errors='coerce').fillna(0.0)
+    })
+
+    # NASS can report the same statistic twice per county-year (e.g. grain and
+    # silage PRODUCTION); keep the first one, then pivot without aggregation
+    index_cols = ['year', 'county_fips', 'county_name', 'state_alpha']
+    df_long = df_long.drop_duplicates(subset=index_cols + ['statistic'], keep='first')
+    df_wide = df_long.pivot(index=index_cols, columns='statistic', values='value').reset_index()
 
     return df_wide
 
 
+def stage_state_frames(responses, staging_path):
+    """
+    Parses each state's records and appends them to a staging Parquet file as
+    they are processed, instead of holding every state frame for one concat.
+    Returns the set of statistics seen, or None if no state had data.
+    """
+    index_cols = ['year', 'county_fips', 'county_name', 'state_alpha']
+    seen_stats = set()
+    writer = None
+
+    try:
+        for state_alpha in CORN_BELT_STATES:
+            print(f"  {state_alpha}...", end=" ")
+
+            # Drop the raw records as soon as they are parsed
+            records = responses.pop(state_alpha)
+
+            if records is not None:
+                df_state = parse_nass_json_to_df(records, state_alpha)
+                if not df_state.empty:
+                    # Fixed column set so every state fits one schema
+                    seen_stats.update(df_state.columns.intersection(STAT_CATEGORIES))
+                    table = pa.Table.from_pandas(
+                        df_state.reindex(columns=index_cols + STAT_CATEGORIES), preserve_index=False
+                    )
+                    if writer is None:
+                        writer = pq.ParquetWriter(staging_path, table.schema, compression='zstd')
+                    writer.write_table(table.cast(writer.schema))
+                    print(f"✅ ({len(df_state)} county-years)")
+                else:
+                    print("⚠️ No data")
+            else:
+                print("❌ API Error")
+    finally:
+        if writer is not None:
+            writer.close()
+
+    return seen_stats if writer is not None else None
+
+
+def write_json_records(df, path):
+    """
+    Write the DataFrame as a compact JSON array of records (NaN -> null).
+    """
+    with open(path, 'wb') as f:
+        f.write(orjson.dumps(df.to_dict('records')))
+
+
 @click.command()
 @click.option('--crop', '-c', required=True, type=click.Choice(list(CROPS.keys())),
               help='Crop name (corn, soybeans, wheat, cotton)')
 @click.option('--start', '-s', required=True, type=int, help='Start year')
 @click.option('--end', '-e', required=True, type=int, help='End year')
-def main(crop, start, end):
+@click.option('--no-cache', is_flag=True, help='Ignore cached NASS query results')
+def main(crop, start, end, no_cache):
     """
     Extracts USDA NASS agricultural data.
     Merges with Census Bureau county land area and coordinates.
@@ -296,47 +469,24 @@ def main(crop, start, end):
         print("❌ Error: NASS_API_KEY environment variable not set.")
         sys.exit(1)
 
-    # 1. Fetch County Geo Reference (Area + Lat/Lon)
-    geo_ref_df = fetch_geo_data_from_census()
+    geo_ref_df, responses = asyncio.run(download_all(crop, start, end, api_key, not no_cache))
 
-    commodity = CROPS[crop]
-    all_data = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        staging_path = Path(tmp_dir) / 'nass_raw.parquet'
+        seen_stats = stage_state_frames(responses, staging_path)
 
-    print("-" * 60)
-    print(f"🌽 Starting extraction for {crop.upper()} ({start}-{end})")
-    
-    with httpx.Client(headers=API_HEADERS) as client:
-        for year in range(start, end + 1):
-            print(f"📅 Processing Year: {year}")
-
-            for state_alpha in CORN_BELT_STATES:
-                print(f"  Downloading {state_alpha}...", end=" ", flush=True)
-                time.sleep(0.5)
-
-                records = fetch_state_crop_data(client, api_key, state_alpha, commodity, year)
-
-                if records is not None:
-                    df_state = parse_nass_json_to_df(records, state_alpha)
-                    if not df_state.empty:
-                        all_data.append(df_state)
-                        print(f"✅ ({len(df_state)} counties)")
-                    else:
-                        print("⚠️ No data")
-                else:
-                    print("❌ API Error")
+        print("-" * 60)
 
-    print("-" * 60)
-
-    if not all_data:
-        print("❌ No data collected. Exiting.")
-        sys.exit(1)
+        if seen_stats is None:
+            print("❌ No data collected. Exiting.")
+            sys.exit(1)
 
-    final_df = pd.concat(all_data, ignore_index=True)
+        final_df = pd.read_parquet(staging_path)
 
     # --- Post Processing ---
 
-    for stat in ['AREA PLANTED', 'YIELD', 'PRODUCTION']:
-        if stat not in final_df.columns:
+    for stat in STAT_CATEGORIES:
+        if stat not in seen_stats:
             final_df[stat] = 0.0
 
     final_df.rename(columns={
@@ -351,6 +501,7 @@ def main(crop, start, end):
     # --- Merge with Geo Data (Lat/Lon/Acres) ---
     # We use a Left Join on FIPS
     if not geo_ref_df.empty:
+        geo_ref_df = geo_ref_df.assign(fips=geo_ref_df['fips'].astype('uint32'))
         final_df = final_df.merge(geo_ref_df, left_on='county_fips', right_on='fips', how='left')
         
         # Fill missing geo data with 0 or NaN
@@ -363,6 +514,9 @@ def main(crop, start, end):
 
     final_df.rename(columns={'area_acres': 'total_county_area_acres'}, inplace=True)
 
+    # Back to the 5-digit zero-padded FIPS string for output
+    final_df['county_fips'] = final_df['county_fips'].astype(str).str.zfill(5)
+
     # Final column selection
     cols_order = [
         'year',
@@ -381,25 +535,29 @@ def main(crop, start, end):
     cols_order = [c for c in cols_order if c in final_df.columns]
 
     final_df = final_df[cols_order]
-    final_df.sort_values(by=['year', 'state_alpha', 'county_name'], inplace=True)
+    # Sorted once, before the concurrent writes; a fresh RangeIndex avoids reindexing
+    final_df.sort_values(by=['year', 'state_alpha', 'county_name'], inplace=True, kind='stable', ignore_index=True)
 
     # --- Output ---
     output_base = f"dataset_us_{crop}_{start}_{end}"
 
-    # 1. CSV
     csv_path = f"{output_base}.csv"
-    final_df.to_csv(csv_path, index=False)
-    print(f"💾 Saved CSV: {csv_path}")
-
-    # 2. Parquet
     pq_path = f"{output_base}.parquet"
-    final_df.to_parquet(pq_path, index=False)
-    print(f"💾 Saved Parquet: {pq_path}")
-
-    # 3. JSON (New Addition)
     json_path = f"{output_base}.json"
-    final_df.to_json(json_path, orient='records', indent=4, double_precision=15)
-    print(f"💾 Saved JSON: {json_path}")
+
+    # Write CSV, Parquet and JSON in parallel (pyarrow and file I/O release the GIL)
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        writes = [
+            (executor.submit(final_df.to_csv, csv_path, index=False), f"💾 Saved CSV: {csv_path}"),
+            (executor.submit(
+                final_df.astype(PARQUET_DTYPES).to_parquet, pq_path, index=False,
+                compression='zstd', row_group_size=PARQUET_ROW_GROUP_SIZE
+            ), f"💾 Saved Parquet: {pq_path}"),
+            (executor.submit(write_json_records, final_df, json_path), f"💾 Saved JSON: {json_path}"),
+        ]
+        for future, message in writes:
+            future.result()
+            print(message)
 
     print(f"\nTotal Records: {len(final_df)}")
     filled_geo_count = final_df['latitude'].notna().sum()
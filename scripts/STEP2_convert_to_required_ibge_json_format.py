@@ -3,6 +3,9 @@
 # requires-python = ">=3.10"
 # dependencies = [
 #     "click",
+#     "ijson",
+#     "orjson",
+#     "pyarrow",
 #     "unidecode",
 # ]
 # ///
@@ -10,51 +13,86 @@
 """
 IBGE JSON Converter for HTML App
 Usage:
-    uv run STEP2_convert_to_required_ibge_json_format.py input.json --crop soja --out app_ready_soja_br.json
-    uv run STEP2_convert_to_required_ibge_json_format.py input.json --crop milho --out app_ready_milho_br.json
+    uv run STEP2_convert_to_required_ibge_json_format.py dataset_soja_2000_2024.parquet --crop soja --out app_ready_soja_br.json
+    uv run STEP2_convert_to_required_ibge_json_format.py dataset_milho_2000_2024.json --crop milho --out app_ready_milho_br.json
+
+Input can be the STEP1 Parquet (preferred, only the needed columns are read) or JSON output.
 """
 
-import json
+import ijson
+import orjson
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import re
 import click
 import unicodedata
+from collections import defaultdict
+from functools import lru_cache
 from unidecode import unidecode
 
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
+# STEP1 columns used by the converter
+INPUT_COLUMNS = [
+    'year', 'region_name', 'state_name', 'municipio_cod', 'latitude', 'longitude',
+    'production_1000t', 'area_planted_1000ha'
+]
+
+@lru_cache(maxsize=None)
 def normalize_slug(text):
     """
     Transforms 'Abaré - BA' into 'abare-ba'.
     Removes accents, spaces, special chars.
+    Cached: each municipality name repeats once per year.
     """
     if not text: return "unknown"
     # Remove accents using unidecode
     text = unidecode(text).lower()
-    # Replace non-alphanumeric with hyphen
-    text = re.sub(r'[^a-z0-9]', '-', text)
-    # Remove duplicate hyphens and strip
-    text = re.sub(r'-+', '-', text).strip('-')
+    # Replace runs of non-alphanumerics with a single hyphen and strip
+    text = _SLUG_RE.sub('-', text).strip('-')
     return text
 
+def widen_float32(batch):
+    """
+    STEP1 stores measures/coordinates as float32 in Parquet. Widen them through
+    their shortest decimal text so 12.345 comes back as 12.345, not 12.345000267.
+    """
+    columns = [
+        pc.cast(pc.cast(col, pa.string()), pa.float64()) if pa.types.is_float32(col.type) else col
+        for col in batch.columns
+    ]
+    return pa.RecordBatch.from_arrays(columns, names=batch.schema.names)
+
+def iter_records(path):
+    """
+    Yields records one at a time, so the whole input is never materialized as a list.
+    Parquet is read in column-projected batches; JSON arrays are stream-parsed.
+    """
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(columns=INPUT_COLUMNS):
+            yield from widen_float32(batch).to_pylist()
+        return
+    with open(path, 'rb') as f:
+        yield from ijson.items(f, 'item', use_float=True)
+
 @click.command()
 @click.argument('input_file', type=click.Path(exists=True))
 @click.option('--crop', '-c', required=True, help='Crop name (soja, milho)')
 @click.option('--out', '-o', default='app_ready_ibge.json', help='Output JSON file')
 def main(input_file, crop, out):
     """
-    Converts flat IBGE JSON (1000 ha/t) to App Hierarchical JSON (ha/tonnes).
+    Converts flat IBGE Parquet/JSON (1000 ha/t) to App Hierarchical JSON (ha/tonnes).
     """
     print(f"📖 Reading {input_file}...")
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
-
-    final_json = {
-        "municipios": {},
-        "area": { crop: {} },
-        "producao": { crop: {} }
-    }
+    municipios = {}
+    # year -> {key: value}; defaultdict avoids a membership check per row
+    area = defaultdict(dict)
+    producao = defaultdict(dict)
 
     count = 0
-    for row in raw_data:
+    for row in iter_records(input_file):
         # Check Geo availability
         if row.get('latitude') is None or row.get('longitude') is None:
             continue
@@ -67,8 +105,8 @@ def main(input_file, crop, out):
         key = normalize_slug(region_name)
 
         # 1. Metadata
-        if key not in final_json['municipios']:
-            final_json['municipios'][key] = {
+        if key not in municipios:
+            municipios[key] = {
                 "lat": row['latitude'],
                 "lon": row['longitude'],
                 "label": region_name,
@@ -81,26 +119,27 @@ def main(input_file, crop, out):
         val_area_1k = row.get('area_planted_1000ha')
         if val_area_1k is not None and val_area_1k > 0:
             area_ha = val_area_1k * 1000
-            
-            if year not in final_json['area'][crop]:
-                final_json['area'][crop][year] = {}
-            final_json['area'][crop][year][key] = round(area_ha, 2)
+            area[year][key] = round(area_ha, 2)
 
         # 3. Production Conversion: 1000 t -> t
         # Input key: "production_1000t"
         val_prod_1k = row.get('production_1000t')
         if val_prod_1k is not None and val_prod_1k > 0:
             prod_ton = val_prod_1k * 1000
-            
-            if year not in final_json['producao'][crop]:
-                final_json['producao'][crop][year] = {}
-            final_json['producao'][crop][year][key] = round(prod_ton, 2)
+            producao[year][key] = round(prod_ton, 2)
         
         count += 1
 
+    final_json = {
+        "municipios": municipios,
+        "area": { crop: dict(area) },
+        "producao": { crop: dict(producao) }
+    }
+
     # Save
-    with open(out, 'w', encoding='utf-8') as f:
-        json.dump(final_json, f, separators=(',', ':'), ensure_ascii=False)
+    with open(out, 'wb') as f:
+        # orjson writes compact UTF-8 JSON
+        f.write(orjson.dumps(final_json))
 
     print(f"✅ Success! Saved to {out}")
     print(f"   Processed {count} records.")
@@ -3,19 +3,27 @@
 # requires-python = ">=3.10"
 # dependencies = [
 #     "click",
+#     "numpy",
+#     "orjson",
+#     "pandas",
+#     "pyarrow",
 # ]
 # ///
 
 """
 NASS JSON Converter for HTML App
 Usage:
-    uv run STEP2_convert_to_required_nass_json_format.py input.json --crop corn --out app_ready_corn_usa.json
-    uv run STEP2_convert_to_required_nass_json_format.py input.json --crop soybeans --out app_ready_soybeans_usa.json
-    uv run STEP2_convert_to_required_nass_json_format.py input.json --crop wheat --out app_ready_wheat_usa.json
+    uv run STEP2_convert_to_required_nass_json_format.py dataset_us_corn_2000_2024.parquet --crop corn --out app_ready_corn_usa.json
+    uv run STEP2_convert_to_required_nass_json_format.py dataset_us_soybeans_2000_2024.parquet --crop soybeans --out app_ready_soybeans_usa.json
+    uv run STEP2_convert_to_required_nass_json_format.py dataset_us_wheat_2000_2024.json --crop wheat --out app_ready_wheat_usa.json
+
+Input can be the STEP1 Parquet (preferred, only the needed columns are read) or JSON output.
 
 """
 
-import json
+import numpy as np
+import orjson
+import pandas as pd
 import re
 import click
 from pathlib import Path
@@ -25,12 +33,44 @@ from pathlib import Path
 # ACRES_TO_HA = 0.404686 (NOT USED - keeping acres)
 # BUSHEL_TO_TONNES conversion factors (NOT USED - keeping bushels)
 
-def make_slug(name, state):
-    """Generates 'adair-ia' from 'Adair' and 'IA'."""
-    if not name or not state: return "unknown"
-    clean_name = re.sub(r'[^a-zA-Z0-9]', '-', name.lower())
-    clean_name = re.sub(r'-+', '-', clean_name).strip('-')
-    return f"{clean_name}-{state.lower().strip()}"
+_SLUG_RE = re.compile(r'[^a-z0-9]+')
+
+# STEP1 columns used by the converter
+INPUT_COLUMNS = [
+    'year', 'county_name', 'state_alpha', 'latitude', 'longitude',
+    'area_planted_1000acres', 'production_1000bu'
+]
+
+def load_input(input_file):
+    """Loads the STEP1 output from Parquet (column projection) or a JSON records array."""
+    if input_file.endswith('.parquet'):
+        df = pd.read_parquet(input_file, columns=INPUT_COLUMNS)
+        # STEP1 stores the name columns as categoricals
+        return df.astype({'county_name': object, 'state_alpha': object})
+    with open(input_file, 'rb') as f:
+        return pd.DataFrame(orjson.loads(f.read()))
+
+def make_slugs(names, states):
+    """Generates 'adair-ia' from 'Adair' and 'IA', for whole columns at once."""
+    clean_names = names.str.lower().str.replace(_SLUG_RE, '-', regex=True).str.strip('-')
+    slugs = clean_names + '-' + states.str.lower().str.strip()
+    has_both = names.fillna('').ne('') & states.fillna('').ne('')
+    return slugs.where(has_both, 'unknown')
+
+def nest_by_year(df, value_col):
+    """
+    Builds {year: {key: value}} from the positive values of a column,
+    keeping the input order of years and keys.
+    """
+    if value_col not in df.columns:
+        return {}
+    valid = df.loc[df[value_col] > 0, ['year', 'key']]
+    # Round the whole column at once instead of calling round() per value
+    valid['value'] = np.round(df.loc[valid.index, value_col].to_numpy(dtype='float64'), 2)
+    return {
+        year: dict(zip(group['key'], group['value'].tolist()))
+        for year, group in valid.groupby('year', sort=False)
+    }
 
 @click.command()
 @click.argument('input_file', type=click.Path(exists=True))
@@ -38,70 +78,45 @@ def make_slug(name, state):
 @click.option('--out', '-o', default='app_ready_nass.json', help='Output JSON file')
 def main(input_file, crop, out):
     """
-    Converts flat NASS JSON to App Hierarchical JSON (keeping imperial units: acres/bushels).
+    Converts flat NASS Parquet/JSON to App Hierarchical JSON (keeping imperial units: acres/bushels).
     """
     print(f"📖 Reading {input_file}...")
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
+    df = load_input(input_file)
+
+    # Skip if no coordinates
+    df = df[df['latitude'].notna() & df['longitude'].notna()]
+    count = len(df)
+
+    df = df.assign(
+        year=df['year'].astype(str),
+        key=make_slugs(df['county_name'], df['state_alpha'])
+    )
+
+    # 1. Metadata (Geographic): first row seen for each county
+    first = df.drop_duplicates('key')
+    labels = first['county_name'] + ' (' + first['state_alpha'] + ')'
+    municipios = {
+        key: {"lat": lat, "lon": lon, "label": label, "uf": state}
+        for key, lat, lon, label, state in zip(
+            first['key'], first['latitude'].tolist(), first['longitude'].tolist(), labels, first['state_alpha']
+        )
+    }
 
     # App Structure
+    # 2. Area: Keeping in 1000 Acres (imperial units), input "area_planted_1000acres"
+    # 3. Production: Keeping in 1000 Bushels (imperial units), input "production_1000bu"
+    # No conversion factor needed - keeping imperial units
     final_json = {
-        "municipios": {},
-        "area": { crop: {} },
-        "producao": { crop: {} }
+        "municipios": municipios,
+        "area": { crop: nest_by_year(df, 'area_planted_1000acres') },
+        "producao": { crop: nest_by_year(df, 'production_1000bu') }
     }
 
-    # No conversion factor needed - keeping imperial units
-    count = 0
-
-    for row in raw_data:
-        # Skip if no coordinates
-        if row.get('latitude') is None or row.get('longitude') is None:
-            continue
-
-        year = str(row['year'])
-        county = row['county_name']
-        state = row['state_alpha']
-        key = make_slug(county, state)
-
-        # 1. Metadata (Geographic)
-        if key not in final_json['municipios']:
-            final_json['municipios'][key] = {
-                "lat": row['latitude'],
-                "lon": row['longitude'],
-                "label": f"{county} ({state})",
-                "uf": state
-            }
-
-        # 2. Area: Keeping in 1000 Acres (imperial units)
-        # The input is usually "area_planted_1000acres"
-        val_area_1k = row.get('area_planted_1000acres')
-        if val_area_1k is not None and val_area_1k > 0:
-            # Keep in 1000 acres (no conversion)
-            area_acres = val_area_1k
-
-            if year not in final_json['area'][crop]:
-                final_json['area'][crop][year] = {}
-            final_json['area'][crop][year][key] = round(area_acres, 2)
-
-        # 3. Production: Keeping in 1000 Bushels (imperial units)
-        # The input is usually "production_1000bu"
-        val_prod_1k = row.get('production_1000bu')
-        if val_prod_1k is not None and val_prod_1k > 0:
-            # Keep in 1000 bushels (no conversion)
-            prod_bu = val_prod_1k
-
-            if year not in final_json['producao'][crop]:
-                final_json['producao'][crop][year] = {}
-            final_json['producao'][crop][year][key] = round(prod_bu, 2)
-        
-        count += 1
-
     # Save
-    with open(out, 'w', encoding='utf-8') as f:
-        # Use separators for compact JSON
-        json.dump(final_json, f, separators=(',', ':'))
+    with open(out, 'wb') as f:
+        # orjson writes compact JSON
+        f.write(orjson.dumps(final_json))
 
     print(f"✅ Success! Saved to {out}")
     print(f"   Processed {count} records.")
@@ -12,19 +12,26 @@ Usage:
 # dependencies = [
 #   "pandas>=2.0.0",
 #   "click>=8.0.0",
+#   "orjson>=3.9.0",
 #   "requests>=2.31.0",
 # ]
 # ///
 
 import click
 import pandas as pd
-import json
+import orjson
+import os
 import sys
+import tempfile
 import time
 import unicodedata
 import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from functools import lru_cache
 from datetime import datetime
+from pathlib import Path
 from typing import Optional, Dict, List, Any
 
 # UF codes to siglas mapping
@@ -51,56 +58,113 @@ STATE_NAME_TO_UF = {
     "DISTRITO FEDERAL": "DF"
 }
 
+# Cache local do dataset de coordenadas (muda raramente)
+COORDS_URL = "https://raw.githubusercontent.com/kelvins/municipios-brasileiros/main/json/municipios.json"
+CACHE_DIR = Path.home() / '.coord_cache'
+COORDS_CACHE_FILE = CACHE_DIR / 'municipios.json'
+CACHE_MAX_AGE_DAYS = 30
+
+# Sessão HTTP com novas tentativas (backoff) para falhas transitórias de rede
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', HTTPAdapter(max_retries=Retry(
+    total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+)))
+
+# Colunas lidas dos CSVs (as demais são ignoradas no parse)
+# Medidas ficam em float64: float32 mudaria o arredondamento de valores como 0.15
+CSV_DTYPES = {
+    'year': 'int32',
+    'region_name': str,
+    'state_name': str,
+    'area_planted_1000ha': 'float64',
+    'production_1000t': 'float64',
+    'total_muni_area_ha': 'float64',
+}
+
+_RE_NON_ALNUM = re.compile(r'[^a-z0-9\s-]')
+_RE_SPACES = re.compile(r'\s+')
+
+@lru_cache(maxsize=8192)
 def normalizar_nome(nome: str) -> str:
-    """Remove acentos e normaliza nome para chave."""
+    """Remove acentos e normaliza nome para chave (cacheado: ~5600 nomes distintos)."""
     nome = unicodedata.normalize('NFKD', nome)
     nome = ''.join(c for c in nome if not unicodedata.combining(c))
     nome = nome.lower().strip()
-    nome = re.sub(r'[^a-z0-9\s-]', '', nome)
-    nome = re.sub(r'\s+', '-', nome)
+    nome = _RE_NON_ALNUM.sub('', nome)
+    nome = _RE_SPACES.sub('-', nome)
     return nome
 
-def criar_chave_municipio(nome: str, uf: str) -> str:
-    """Cria chave padronizada: nome-uf (ex: sorriso-mt)."""
-    # Se o nome já contém " - UF", extrair apenas o nome
-    if " - " in nome:
-        nome = nome.split(" - ")[0].strip()
-
-    nome_norm = normalizar_nome(nome)
-    return f"{nome_norm}-{uf.lower()}"
-
-def mapear_uf(nome_uf: str) -> Optional[str]:
-    """Mapeia nome do estado para sigla."""
-    nome_uf_upper = nome_uf.upper().strip()
-    return STATE_NAME_TO_UF.get(nome_uf_upper)
-
 def log(msg: str, level: str = "info"):
     """Log formatado."""
     icons = {"info": "INFO", "success": "OK", "error": "ERR", "warn": "WARN"}
     print(f"[{icons.get(level, 'INFO')}] {msg}", file=sys.stderr)
 
-def baixar_coordenadas_municipios() -> Dict[str, Dict[str, Any]]:
-    """Baixa dataset de coordenadas dos municípios brasileiros."""
-    log("Baixando dataset de coordenadas...")
-    url = "https://raw.githubusercontent.com/kelvins/municipios-brasileiros/main/json/municipios.json"
+def carregar_cache_coordenadas() -> Optional[bytes]:
+    """Lê o JSON de coordenadas do cache local, se existir e estiver atualizado."""
+    if not COORDS_CACHE_FILE.exists():
+        return None
+
+    cache_age_days = (datetime.now().timestamp() - COORDS_CACHE_FILE.stat().st_mtime) / (24 * 3600)
+    if cache_age_days > CACHE_MAX_AGE_DAYS:
+        return None
 
+    log(f"Usando coordenadas do cache: {COORDS_CACHE_FILE}")
+    return COORDS_CACHE_FILE.read_bytes()
+
+def salvar_cache_coordenadas(raw: bytes):
+    """Salva o JSON de coordenadas baixado no cache local (escrita atômica)."""
+    tmp_path = None
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        data = response.json()
-
-        coords_lookup = {}
-        for m in data:
-            uf = UF_SIGLAS.get(m['codigo_uf'], '')
-            if not uf:
-                continue
-
-            chave = f"{normalizar_nome(m['nome'])}-{uf.lower()}"
-            coords_lookup[chave] = {
-                'lat': m['latitude'],
-                'lon': m['longitude'],
-                'cod_ibge': str(m['codigo_ibge'])
-            }
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        # Arquivo temporário + os.replace: o cache nunca fica truncado pela metade
+        with tempfile.NamedTemporaryFile(dir=CACHE_DIR, suffix='.tmp', delete=False) as tmp:
+            tmp_path = tmp.name
+            tmp.write(raw)
+        os.replace(tmp_path, COORDS_CACHE_FILE)
+    except OSError as e:
+        log(f"Não foi possível salvar o cache de coordenadas: {e}", "warn")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def montar_lookup_coordenadas(raw: bytes) -> Dict[str, Dict[str, Any]]:
+    """Monta o lookup chave-do-município -> coordenadas a partir do JSON bruto."""
+    df = pd.DataFrame(orjson.loads(raw))
+
+    uf = df['codigo_uf'].map(UF_SIGLAS)
+    df = df[uf.notna()]
+    uf = uf[uf.notna()]
+
+    # Normaliza cada nome único uma só vez
+    nome_norm = df['nome'].map({n: normalizar_nome(n) for n in df['nome'].unique()})
+    chaves = nome_norm + '-' + uf.str.lower()
+
+    return {
+        chave: {'lat': lat, 'lon': lon, 'cod_ibge': str(cod)}
+        for chave, lat, lon, cod in zip(
+            chaves, df['latitude'].tolist(), df['longitude'].tolist(), df['codigo_ibge'].tolist()
+        )
+    }
+
+def baixar_coordenadas_municipios() -> Dict[str, Dict[str, Any]]:
+    """Baixa dataset de coordenadas dos municípios brasileiros (com cache local de 30 dias)."""
+    try:
+        coords_lookup = None
+        raw = carregar_cache_coordenadas()
+        if raw is not None:
+            try:
+                coords_lookup = montar_lookup_coordenadas(raw)
+            except Exception as e:
+                # Cache corrompido: descarta e baixa de novo
+                log(f"Cache de coordenadas inválido ({e}), baixando novamente", "warn")
+                COORDS_CACHE_FILE.unlink(missing_ok=True)
+
+        if coords_lookup is None:
+            log("Baixando dataset de coordenadas...")
+            response = HTTP_SESSION.get(COORDS_URL, timeout=30)
+            response.raise_for_status()
+            raw = response.content
+            coords_lookup = montar_lookup_coordenadas(raw)
+            salvar_cache_coordenadas(raw)
 
         log(f"Coordenadas baixadas: {len(coords_lookup)} municípios")
         return coords_lookup
@@ -109,70 +173,67 @@ def baixar_coordenadas_municipios() -> Dict[str, Dict[str, Any]]:
         log(f"Erro ao baixar coordenadas: {e}", "error")
         return {}
 
-def processar_csv(csv_path: str, cultura: str, coords_lookup: Dict[str, Dict[str, Any]]) -> tuple[Dict, Dict, Dict]:
+def processar_csv(csv_path: str, cultura: str, coords_lookup: Dict[str, Dict[str, Any]]) -> tuple[Dict, Dict, Dict, pd.Series]:
     """
     Processa CSV de uma cultura específica.
 
-    Retorna: (area_data, producao_data, area_total_data)
+    Retorna: (area_data, producao_data, area_total_data, chaves)
     """
     log(f"Processando CSV {cultura}: {csv_path}")
 
     try:
-        df = pd.read_csv(csv_path)
+        df = pd.read_csv(csv_path, usecols=list(CSV_DTYPES), dtype=CSV_DTYPES, engine='c', low_memory=False)
     except Exception as e:
         log(f"Erro ao ler CSV {csv_path}: {e}", "error")
-        return {}, {}, {}
+        return {}, {}, {}, pd.Series(dtype=str)
+
+    # Mapear UF
+    uf = df['state_name'].astype(str).str.upper().str.strip().map(STATE_NAME_TO_UF)
+    for estado in df.loc[uf.isna(), 'state_name'].astype(str):
+        log(f"UF não reconhecida: {estado}", "warn")
+    df = df[uf.notna()]
+    uf = uf[uf.notna()]
+
+    # Criar chave do município (normalizando cada nome único uma só vez)
+    # Se o nome já contém " - UF", extrair apenas o nome
+    nome = df['region_name'].astype(str).str.split(' - ', n=1).str[0]
+    nome_norm = nome.map({n: normalizar_nome(n) for n in nome.unique()})
+
+    registros = pd.DataFrame({
+        'year': df['year'].astype(int).astype(str),
+        'chave': nome_norm + '-' + uf.str.lower(),
+        'area_plantada': df['area_planted_1000ha'].fillna(0.0).astype(float),
+        'producao': df['production_1000t'].fillna(0.0).astype(float),
+        'area_total_ha': df['total_muni_area_ha'].fillna(0.0).astype(float),
+    })
+
+    # Pular registros sem produção significativa
+    registros = registros[(registros['area_plantada'] > 0) | (registros['producao'] > 0)]
 
     area_data = {}
     producao_data = {}
-    area_total_data = {}
-
-    for _, row in df.iterrows():
-        year = str(int(row['year']))
-        municipio = str(row['region_name'])
-        estado = str(row['state_name'])
-
-        # Mapear UF
-        uf = mapear_uf(estado)
-        if not uf:
-            log(f"UF não reconhecida: {estado}", "warn")
-            continue
-
-        # Criar chave do município
-        chave = criar_chave_municipio(municipio, uf)
-
-        # Extrair valores
-        area_plantada = float(row['area_planted_1000ha']) if pd.notna(row['area_planted_1000ha']) else 0.0
-        producao = float(row['production_1000t']) if pd.notna(row['production_1000t']) else 0.0
-        area_total_ha = float(row['total_muni_area_ha']) if pd.notna(row['total_muni_area_ha']) else 0.0
-
-        # Pular registros sem produção significativa
-        if area_plantada <= 0 and producao <= 0:
-            continue
-
-        # Inicializar estruturas se necessário
-        if cultura not in area_data:
-            area_data[cultura] = {}
-        if year not in area_data[cultura]:
-            area_data[cultura][year] = {}
-
-        if cultura not in producao_data:
-            producao_data[cultura] = {}
-        if year not in producao_data[cultura]:
-            producao_data[cultura][year] = {}
-
-        # Armazenar dados
-        area_data[cultura][year][chave] = round(area_plantada, 2)
-        producao_data[cultura][year][chave] = round(producao, 1)
-
-        # Área total (usar sempre a mais recente disponível)
-        if area_total_ha > 0:
-            area_total_mil_ha = round(area_total_ha / 1000, 2)  # converter para mil hectares
-            area_total_data[chave] = area_total_mil_ha
+    if not registros.empty:
+        area_data[cultura] = {}
+        producao_data[cultura] = {}
+        for year, grupo in registros.groupby('year', sort=False):
+            area_data[cultura][year] = dict(zip(grupo['chave'], [round(v, 2) for v in grupo['area_plantada'].tolist()]))
+            producao_data[cultura][year] = dict(zip(grupo['chave'], [round(v, 1) for v in grupo['producao'].tolist()]))
+
+    # Área total (usar sempre a mais recente disponível), convertida para mil hectares
+    # Um valor por município (o último registro), em vez de reescrever a cada linha
+    ultima_area_total = (
+        registros[registros['area_total_ha'] > 0]
+        .groupby('chave', sort=False)['area_total_ha']
+        .last()
+    )
+    area_total_data = {
+        chave: round(v / 1000, 2)
+        for chave, v in zip(ultima_area_total.index, ultima_area_total.tolist())
+    }
 
     log(f"{cultura}: {len(area_total_data)} municípios únicos")
 
-    return area_data, producao_data, area_total_data
+    return area_data, producao_data, area_total_data, registros['chave']
 
 def adicionar_coordenadas(municipios_data: Dict[str, Dict], coords_lookup: Dict[str, Dict[str, Any]]) -> tuple[int, int]:
     """Adiciona coordenadas aos dados dos municípios."""
@@ -194,20 +255,25 @@ def adicionar_coordenadas(municipios_data: Dict[str, Dict], coords_lookup: Dict[
 
 def validar_dados(area_data: Dict, producao_data: Dict, area_total_data: Dict) -> List[str]:
     """Valida consistência dos dados."""
-    warnings = []
-
-    for cultura, anos_data in area_data.items():
-        for ano, mun_data in anos_data.items():
-            for mun, area_plantada in mun_data.items():
-                area_total = area_total_data.get(mun, 0)
-
-                if area_total > 0 and area_plantada > area_total:
-                    warnings.append(
-                        f"ERRO: {mun} {cultura} {ano}: área plantada ({area_plantada:.1f} mil ha) > "
-                        f"área total ({area_total:.1f} mil ha)"
-                    )
-
-    return warnings
+    # Tabela longa (cultura, ano, município) comparada de uma vez só
+    registros = pd.DataFrame(
+        [
+            (cultura, ano, mun, area_plantada)
+            for cultura, anos_data in area_data.items()
+            for ano, mun_data in anos_data.items()
+            for mun, area_plantada in mun_data.items()
+        ],
+        columns=['cultura', 'ano', 'mun', 'area_plantada']
+    )
+    registros['area_total'] = registros['mun'].map(area_total_data).fillna(0)
+
+    invalidos = registros[(registros['area_total'] > 0) & (registros['area_plantada'] > registros['area_total'])]
+
+    return [
+        f"ERRO: {r.mun} {r.cultura} {r.ano}: área plantada ({r.area_plantada:.1f} mil ha) > "
+        f"área total ({r.area_total:.1f} mil ha)"
+        for r in invalidos.itertuples(index=False)
+    ]
 
 @click.command()
 @click.option('--input-soja', type=click.Path(exists=True),
@@ -248,28 +314,24 @@ def main(input_soja: str, input_milho: str, output: Optional[str], output_json:
         coords_lookup = baixar_coordenadas_municipios()
 
     # Processar soja
-    area_soja, producao_soja, area_total_soja = processar_csv(input_soja, "soja", coords_lookup)
+    area_soja, producao_soja, area_total_soja, chaves_soja = processar_csv(input_soja, "soja", coords_lookup)
     resultado["area"].update(area_soja)
     resultado["producao"].update(producao_soja)
     resultado["areaTotal"].update(area_total_soja)
 
     # Processar milho
-    area_milho, producao_milho, area_total_milho = processar_csv(input_milho, "milho", coords_lookup)
+    area_milho, producao_milho, area_total_milho, chaves_milho = processar_csv(input_milho, "milho", coords_lookup)
     resultado["area"].update(area_milho)
     resultado["producao"].update(producao_milho)
     resultado["areaTotal"].update(area_total_milho)
 
     # Coletar lista de municípios únicos
-    municipios_unicos = set()
-    for cultura_data in resultado["area"].values():
-        for ano_data in cultura_data.values():
-            municipios_unicos.update(ano_data.keys())
+    municipios_unicos = pd.unique(pd.concat([chaves_soja, chaves_milho]))
 
     log(f"Total municípios únicos: {len(municipios_unicos)}")
 
-    # Criar estrutura de municípios
-    for mun in municipios_unicos:
-        resultado["municipios"][mun] = {}
+    # Criar estrutura de municípios (um dict próprio por município)
+    resultado["municipios"] = {mun: {} for mun in municipios_unicos}
 
     # Adicionar coordenadas (se baixadas)
     if coords_lookup:
@@ -301,15 +363,16 @@ def main(input_soja: str, input_milho: str, output: Optional[str], output_json:
     log(f"  - Milho: {len(anos_milho)} anos ({min(anos_milho)}-{max(anos_milho) if anos_milho else 'N/A'})")
 
     # Output
-    resultado_json = json.dumps(resultado, indent=2, ensure_ascii=False)
+    resultado_json = orjson.dumps(resultado, option=orjson.OPT_INDENT_2)
 
     if output:
-        with open(output, 'w', encoding='utf-8') as f:
+        with open(output, 'wb') as f:
             f.write(resultado_json)
         log(f"Dados salvos em: {output}", "success")
 
     if output_json or not output:
-        print(resultado_json)
+        sys.stdout.buffer.write(resultado_json + b"\n")
+        sys.stdout.flush()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The pipelines are standalone scripts, not an installed package
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'scripts'))
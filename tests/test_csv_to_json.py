@@ -0,0 +1,27 @@
+import orjson
+
+import csv_to_json
+
+
+class FakeResponse:
+    content = orjson.dumps([{
+        'codigo_ibge': 5300108, 'nome': 'Brasília', 'latitude': -15.7795,
+        'longitude': -47.9297, 'codigo_uf': 53,
+    }])
+
+    def raise_for_status(self):
+        pass
+
+
+def test_corrupt_coordinate_cache_is_downloaded_again(tmp_path, monkeypatch):
+    cache_file = tmp_path / 'municipios.json'
+    cache_file.write_bytes(b'[{"codigo_ibge": 53')
+    monkeypatch.setattr(csv_to_json, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(csv_to_json, 'COORDS_CACHE_FILE', cache_file)
+    monkeypatch.setattr(csv_to_json.HTTP_SESSION, 'get', lambda url, timeout: FakeResponse())
+
+    coords = csv_to_json.baixar_coordenadas_municipios()
+
+    assert coords == {'brasilia-df': {'lat': -15.7795, 'lon': -47.9297, 'cod_ibge': '5300108'}}
+    assert cache_file.read_bytes() == FakeResponse.content
+    assert list(tmp_path.iterdir()) == [cache_file]
@@ -0,0 +1,29 @@
+import json
+from datetime import datetime, time
+
+import pandas as pd
+
+from extract_crop_calendar import dataframe_to_records
+
+
+def test_mixed_int_and_date_column_is_serializable():
+    # calamine returns integral cells as ints, so a date column can be 'mixed-integer'
+    df = pd.DataFrame({'date': pd.Series([datetime(2000, 5, 3), 125, None], dtype=object)})
+
+    records = dataframe_to_records(df)
+
+    assert records == [{'date': '2000-05-03'}, {'date': 125}, {'date': None}]
+    json.dumps(records)
+
+
+def test_timedelta_and_time_cells_are_written_as_text():
+    df = pd.DataFrame({
+        'object': pd.Series([pd.Timedelta(days=1), time(6, 30), 'x', 1.5], dtype=object),
+        'duration': pd.to_timedelta([1, 2, None, 3], unit='D'),
+    })
+
+    records = dataframe_to_records(df)
+
+    assert [r['object'] for r in records] == ['1 days 00:00:00', '06:30:00', 'x', 1.5]
+    assert [r['duration'] for r in records] == ['1 days 00:00:00', '2 days 00:00:00', None, '3 days 00:00:00']
+    json.dumps(records)
@@ -0,0 +1,11 @@
+import pyarrow as pa
+
+from filter_coffee_data import filter_zero_yield
+
+
+def test_null_yield_rows_are_kept():
+    table = pa.table({'yield_kg_ha': [0.0, None, 850.5, 0.0]})
+
+    filtered = filter_zero_yield(table)
+
+    assert filtered['yield_kg_ha'].to_pylist() == [None, 850.5]
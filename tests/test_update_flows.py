@@ -0,0 +1,56 @@
+import os
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+import update_flows
+
+
+def weekly_positions(start, end):
+    dates = pd.date_range(start, end, freq='W-TUE', name='Date')
+    return pd.DataFrame({'Grains': range(len(dates))}, index=dates)
+
+
+@pytest.fixture
+def positions_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(update_flows, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(update_flows, 'POSITIONS_CACHE_FILE', tmp_path / 'positions.parquet')
+
+    fetched = []
+
+    def fake_download(years):
+        fetched.append(list(years))
+        return pd.DataFrame({'year': years})
+
+    def fake_compute(raw):
+        years = raw['year'].tolist()
+        return weekly_positions(f'{years[0]}-01-01', f'{years[-1]}-12-31')
+
+    monkeypatch.setattr(update_flows, 'download_cftc_data', fake_download)
+    monkeypatch.setattr(update_flows, 'compute_sector_positions', fake_compute)
+    return fetched
+
+
+def write_cache(written_at, end):
+    weekly_positions('2025-01-01', end).to_parquet(update_flows.POSITIONS_CACHE_FILE)
+    ts = written_at.timestamp()
+    os.utime(update_flows.POSITIONS_CACHE_FILE, (ts, ts))
+
+
+def test_cache_written_mid_year_refetches_both_years(positions_cache):
+    write_cache(datetime(2025, 11, 28), '2025-11-28')
+
+    positions = update_flows.load_sector_positions(2026)
+
+    assert positions_cache == [[2025, 2026]]
+    assert (positions.index.year == 2025).sum() == 52
+
+
+def test_cache_written_after_year_end_reuses_previous_year(positions_cache):
+    write_cache(datetime(2026, 2, 1), '2026-01-27')
+
+    positions = update_flows.load_sector_positions(2026)
+
+    assert positions_cache == [[2026]]
+    assert (positions.index.year == 2025).sum() == 52
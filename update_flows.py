@@ -6,6 +6,8 @@
 #     "requests>=2.31",
 #     "xlrd>=2.0.1",
 #     "openpyxl>=3.1.0",
+#     "pyarrow>=14.0",
+#     "orjson>=3.9",
 # ]
 # ///
 
@@ -21,13 +23,25 @@ Usage: uv run update_flows.py
 
 import os
 import sys
-import json
+import orjson
+import re
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from pathlib import Path
 
 # CFTC Data Source
 CFTC_BASE_URL = "https://www.cftc.gov/files/dea/history"
+
+# Shared HTTP session: retries transient failures with backoff
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount('https://', HTTPAdapter(max_retries=Retry(
+    total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]
+)))
+
 # Market codes from CFTC Market_and_Exchange_Names field
 SECTOR_MAPPING = {
     "CORN": "Grains", "WHEAT": "Grains", "WHEAT-SRW": "Grains", "SOYBEANS": "Grains",
@@ -35,87 +49,178 @@ SECTOR_MAPPING = {
     "LIVE CATTLE": "Meats", "LEAN HOGS": "Meats", "FEEDER CATTLE": "Meats",
     "COFFEE": "Softs", "SUGAR": "Softs", "COTTON": "Softs", "COCOA": "Softs",
 }
-
-def download_cftc_data(year: int) -> pd.DataFrame:
-    """Download CFTC Disaggregated COT data for given year(s)."""
+# One alternation over all market keys, longest first so "WHEAT-SRW" wins over "WHEAT"
+_SECTOR_PAT = re.compile(
+    '(' + '|'.join(re.escape(key) for key in sorted(SECTOR_MAPPING, key=len, reverse=True)) + ')'
+)
+
+# Only columns used by compute_sector_positions are parsed from the report
+# (matched case-insensitively: CFTC files mix "_ALL" and "_All" suffixes)
+CFTC_COLUMNS = [
+    'Report_Date_as_MM_DD_YYYY',
+    'Market_and_Exchange_Names',
+    'M_Money_Positions_Long_ALL',
+    'M_Money_Positions_Short_ALL',
+]
+CFTC_COLUMNS_LOWER = {col.lower() for col in CFTC_COLUMNS}
+
+# Parsed reports cached per year: past years are final, the current one changes weekly
+CACHE_DIR = Path.home() / '.cftc_cache'
+CACHE_MAX_AGE_DAYS = 6
+POSITIONS_CACHE_FILE = CACHE_DIR / 'positions.parquet'
+
+def _cache_is_fresh(cache_path: Path, yr: int) -> bool:
+    """A past year is final once cached after its last weekly release; otherwise refresh weekly."""
+    if not cache_path.exists():
+        return False
+    cached_at = datetime.fromtimestamp(cache_path.stat().st_mtime)
+    if cached_at >= datetime(yr + 1, 1, 15):
+        return True
+    return datetime.now() - cached_at < timedelta(days=CACHE_MAX_AGE_DAYS)
+
+def _load_cached_year(yr: int) -> pd.DataFrame | None:
+    """Load a parsed year from the cache if fresh and it has the needed columns."""
+    cache_path = CACHE_DIR / f"fut_disagg_{yr}.parquet"
+    if not _cache_is_fresh(cache_path, yr):
+        return None
+    try:
+        df = pd.read_parquet(cache_path)
+    except Exception as e:
+        print(f"Warning: Could not read {yr} cache: {e}")
+        return None
+    if not CFTC_COLUMNS_LOWER.issubset(str(col).lower() for col in df.columns):
+        return None
+    print(f"Loaded {len(df):,} records from {yr} (cache)")
+    return df
+
+def _save_cached_year(df: pd.DataFrame, yr: int):
+    """Store a parsed year so the next run skips the download and Excel parse."""
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        df.to_parquet(CACHE_DIR / f"fut_disagg_{yr}.parquet", index=False)
+    except Exception as e:
+        print(f"Warning: Could not cache {yr} data: {e}")
+
+def find_column(df: pd.DataFrame, name: str) -> str | None:
+    """Return the actual column matching name, ignoring case."""
+    return next((col for col in df.columns if str(col).lower() == name.lower()), None)
+
+def _read_cot_sheet(zf, cot_file: str) -> pd.DataFrame:
+    """
+    Parse the needed columns of the report workbook.
+    .xlsx is streamed row by row with openpyxl in read-only mode, keeping only
+    the wanted cells; legacy .xls (what CFTC currently ships) goes through xlrd.
+    """
+    import io
+    import openpyxl
+
+    if not cot_file.endswith('.xlsx'):
+        return pd.read_excel(zf.open(cot_file), usecols=lambda col: str(col).lower() in CFTC_COLUMNS_LOWER)
+
+    wb = openpyxl.load_workbook(io.BytesIO(zf.read(cot_file)), read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows)
+        idx = [i for i, h in enumerate(header) if str(h).lower() in CFTC_COLUMNS_LOWER]
+        data = [[row[i] for i in idx] for row in rows]
+    finally:
+        wb.close()
+
+    # Read-only sheets can report trailing blank rows
+    data = [row for row in data if any(v is not None for v in row)]
+    return pd.DataFrame(data, columns=[header[i] for i in idx])
+
+def _fetch_one_year(yr: int) -> pd.DataFrame | None:
+    """Download and parse one year of CFTC data; None if it could not be loaded."""
     import io
     import zipfile
 
-    dfs = []
-    # Load current year and previous year to ensure 20+ weeks of data
-    years_to_load = [year - 1, year]
+    cached = _load_cached_year(yr)
+    if cached is not None:
+        return cached
+
+    zip_url = f"{CFTC_BASE_URL}/fut_disagg_xls_{yr}.zip"
+
+    try:
+        print(f"Downloading {yr} CFTC disaggregated data...")
+        response = HTTP_SESSION.get(zip_url, timeout=60)
+        response.raise_for_status()
 
-    for yr in years_to_load:
-        zip_url = f"{CFTC_BASE_URL}/fut_disagg_xls_{yr}.zip"
+        with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+            file_names = zf.namelist()
+            cot_file = [f for f in file_names if f.endswith('.xls') or f.endswith('.xlsx')][0]
+            df = _read_cot_sheet(zf, cot_file)
+            print(f"Loaded {len(df):,} records from {yr}")
 
-        try:
-            print(f"Downloading {yr} CFTC disaggregated data...")
-            response = requests.get(zip_url, timeout=60)
-            response.raise_for_status()
+        _save_cached_year(df, yr)
+        return df
 
-            with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
-                file_names = zf.namelist()
-                cot_file = [f for f in file_names if f.endswith('.xls') or f.endswith('.xlsx')][0]
-                df = pd.read_excel(zf.open(cot_file))
-                dfs.append(df)
-                print(f"Loaded {len(df):,} records from {yr}")
+    except Exception as e:
+        print(f"Warning: Could not load {yr} data: {e}")
+        return None
 
-        except Exception as e:
-            print(f"Warning: Could not load {yr} data: {e}")
-            continue
+def download_cftc_data(years: list[int]) -> pd.DataFrame:
+    """Download CFTC Disaggregated COT data for the given years (in parallel)."""
+    # Years are independent downloads; one may parse while the other downloads
+    with ThreadPoolExecutor(max_workers=len(years) or 1) as executor:
+        dfs = [df for df in executor.map(_fetch_one_year, years) if df is not None]
 
     if not dfs:
-        print("Download failed: No data loaded")
-        sys.exit(1)
+        raise RuntimeError("Download failed: No data loaded")
 
     combined = pd.concat(dfs, ignore_index=True)
     print(f"Total: {len(combined):,} records")
     return combined
 
-def process_cot_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Process raw COT into weekly sector flows (thousand contracts)."""
+def compute_sector_positions(df: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate raw COT into weekly net Money Manager positions by sector (Date x Sector)."""
     print("Processing hedge fund flows...")
 
-    # Work with a copy to avoid SettingWithCopyWarning
-    df = df.copy()
-
     # Disaggregated data has Money Manager positions as columns, not a category filter
-    # Required columns: M_Money_Positions_Long_ALL, M_Money_Positions_Short_ALL
-    long_col = 'M_Money_Positions_Long_ALL'
-    short_col = 'M_Money_Positions_Short_ALL'
+    # Required columns: M_Money_Positions_Long_ALL, M_Money_Positions_Short_ALL (any casing)
+    long_col = find_column(df, 'M_Money_Positions_Long_ALL')
+    short_col = find_column(df, 'M_Money_Positions_Short_ALL')
 
-    if long_col not in df.columns or short_col not in df.columns:
+    if long_col is None or short_col is None:
         print(f"Available columns: {list(df.columns)[:10]}...")
-        print(f"Money Manager columns not found")
-        sys.exit(1)
+        raise RuntimeError("Money Manager columns not found")
 
-    # Parse dates
-    df['Date'] = pd.to_datetime(df['Report_Date_as_MM_DD_YYYY'])
+    # Map commodities to sectors using Market_and_Exchange_Names, then keep only
+    # the tracked markets so the remaining work touches a handful of rows
+    # (as a categorical, the string ops run once per distinct market name)
+    names_upper = df['Market_and_Exchange_Names'].astype(str).astype('category').str.upper()
+    sector = names_upper.str.extract(_SECTOR_PAT, expand=False).map(SECTOR_MAPPING)
+    tracked = sector.notna()
 
-    # Map commodities to sectors using Market_and_Exchange_Names
-    def get_sector(name):
-        name_upper = str(name).upper()
-        for key, sector in SECTOR_MAPPING.items():
-            if key in name_upper:
-                return sector
-        return None
+    # Copy of the survivors only (avoids SettingWithCopyWarning)
+    df = df.loc[tracked].copy()
 
-    df['Sector'] = df['Market_and_Exchange_Names'].apply(get_sector)
+    if df.empty:
+        raise RuntimeError("No matching commodities found")
 
-    # Filter to mapped commodities only
-    df = df.dropna(subset=['Sector']).copy()
+    # Parse dates: Excel date cells already arrive as datetimes; text dates
+    # use the fixed MM/DD/YYYY layout, so skip per-cell format inference
+    report_dates = df['Report_Date_as_MM_DD_YYYY']
+    if pd.api.types.is_datetime64_any_dtype(report_dates):
+        df['Date'] = report_dates
+    else:
+        df['Date'] = pd.to_datetime(report_dates, format='%m/%d/%Y', cache=True)
 
-    if df.empty:
-        print("No matching commodities found")
-        sys.exit(1)
+    # Categorical sector, so the groupby below works on integer codes
+    df['Sector'] = sector[tracked].astype('category')
 
-    # Calculate net positions (Money Manager long - short)
-    df['Net_Position'] = df[long_col] - df[short_col]
+    # Calculate net positions (Money Manager long - short); contract counts fit in int32
+    net = pd.to_numeric(df[long_col]) - pd.to_numeric(df[short_col])
+    df['Net_Position'] = net.fillna(0).astype('int32')
 
     # Aggregate by date and sector
-    sector_positions = df.groupby(['Date', 'Sector'])['Net_Position'].sum().reset_index()
+    sector_positions = df.groupby(['Date', 'Sector'], observed=True)['Net_Position'].sum().reset_index()
     pivoted = sector_positions.pivot(index='Date', columns='Sector', values='Net_Position')
+    pivoted.columns = pivoted.columns.astype(str)
+    return pivoted
 
+def compute_flows(pivoted: pd.DataFrame) -> pd.DataFrame:
+    """Turn weekly sector positions into weekly flows (thousand contracts), last 20 weeks."""
     # Calculate weekly flows (change from previous week)
     flows = pivoted.diff().fillna(0)
     flows_k = (flows / 1000).round().astype(int)
@@ -130,6 +235,51 @@ def process_cot_data(df: pd.DataFrame) -> pd.DataFrame:
     print(f"Processed {len(flows_k)} weeks")
     return flows_k
 
+def _load_cached_positions() -> pd.DataFrame | None:
+    """Load the cached weekly sector positions, if any."""
+    if not POSITIONS_CACHE_FILE.exists():
+        return None
+    try:
+        return pd.read_parquet(POSITIONS_CACHE_FILE)
+    except Exception as e:
+        print(f"Warning: Could not read positions cache: {e}")
+        return None
+
+def load_sector_positions(current_year: int) -> pd.DataFrame:
+    """
+    Weekly sector positions for the previous and current year, kept in positions.parquet.
+    A cache refreshed within CACHE_MAX_AGE_DAYS is used as is; an older one keeps
+    its previous-year weeks (only if written after that year was final, as in
+    _cache_is_fresh) and only the current year is downloaded and re-aggregated.
+    """
+    cached = _load_cached_positions()
+    if cached is not None:
+        cache_age = datetime.now() - datetime.fromtimestamp(POSITIONS_CACHE_FILE.stat().st_mtime)
+        if cache_age < timedelta(days=CACHE_MAX_AGE_DAYS):
+            print(f"Using cached positions: {POSITIONS_CACHE_FILE}")
+            return cached
+
+    # Previous-year weeks are complete only if cached after that year's last release
+    previous = None
+    if cached is not None:
+        cached_at = datetime.fromtimestamp(POSITIONS_CACHE_FILE.stat().st_mtime)
+        if cached_at >= datetime(current_year, 1, 15):
+            previous = cached[cached.index.year == current_year - 1]
+
+    if previous is not None and not previous.empty:
+        positions = pd.concat([previous, compute_sector_positions(download_cftc_data([current_year]))])
+    else:
+        # Load current year and previous year to ensure 20+ weeks of data
+        positions = compute_sector_positions(download_cftc_data([current_year - 1, current_year]))
+
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        positions.to_parquet(POSITIONS_CACHE_FILE)
+    except Exception as e:
+        print(f"Warning: Could not cache positions: {e}")
+
+    return positions
+
 def save_data_files(df: pd.DataFrame, output_dir: str = "data"):
     """Save both CSV and JSON formats."""
     os.makedirs(output_dir, exist_ok=True)
@@ -161,8 +311,8 @@ def save_data_files(df: pd.DataFrame, output_dir: str = "data"):
         },
         "data": df.to_dict(orient="records")
     }
-    with open(json_path, 'w') as f:
-        json.dump(json_data, f, indent=2, default=str)
+    with open(json_path, 'wb') as f:
+        f.write(orjson.dumps(json_data, option=orjson.OPT_INDENT_2))
     print(f"Saved JSON: {json_path}")
 
 def main():
@@ -172,10 +322,13 @@ def main():
     print(f"Started: {datetime.now()}")
     print("=" * 70)
 
-    # Download and process
+    # Download (or reuse cached positions) and process
     current_year = datetime.now().year
-    cot_raw = download_cftc_data(current_year)
-    flows_data = process_cot_data(cot_raw)
+    try:
+        flows_data = compute_flows(load_sector_positions(current_year))
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
 
     # Show preview
     print(f"\nLatest 3 weeks:")